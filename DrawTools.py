@@ -191,8 +191,7 @@ def ymin_ymax(yvals, scale="") :
     """
 
     global global_min
-    ymax = max(yvals.tolist())
-    ymin = min(yvals.tolist()) 
+    ymin, ymax = HT.minmax(yvals)
     print("ymin ", ymin, "ymax ", ymax)
 
     if scale == "log":
@@ -200,7 +199,7 @@ def ymin_ymax(yvals, scale="") :
         if (ymin <= 0) :
             cut = (yvals>0)
             #print yvals
-            ymin = min(yvals[cut].tolist())
+            ymin = np.min(yvals[cut])
         #ymin *= 0.2 
     else :
         ymax *= 1.3
@@ -319,6 +318,42 @@ def set_DrawDatum(xarray, key, nbins=100, weights=[], x_range=[-1, -1], xbins =[
 
     return datum
 
+def set_DrawDatum_hist(hist, key, color="black", linestyle="-") :
+    """
+    Make DrawDatum object from HistTools.Hist1D, which may be
+    filled incrementally (e.g. by merge_hdf5.FileWatcher).
+    Call it again after filling to update the plot.
+
+    Parameters
+    ----------
+    hist : HistTools.Hist1D
+        filled histogram
+
+    key : string
+        name or description of the histogram, used in the label in legend
+
+    color : string
+        name of color for drawing 
+ 
+    linestyle : string
+        line style marker
+
+    Returns
+    -------
+    datum : DrawDatum object
+
+    """
+    datum = DrawDatum()
+    datum.title = key
+    datum.val, bins, datum.w2s = hist.result()
+    datum.xbinedges = bins
+    datum.xbins = 0.5*(bins[1:]+bins[:-1])
+    datum.color = color
+    datum.linestyle = linestyle
+    datum.counts = hist.entries
+    datum.xmean = hist.mean()
+    return datum
+
 def write_DrawDatum(datum, outfname) :
     data = []
     data.append(datum.xbins)
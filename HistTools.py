@@ -1,7 +1,83 @@
 import numpy as np
-import bisect
 import MathTools as MT
 
+# number of events processed at once for chunked inputs
+CHUNK_SIZE = 1000000
+
+#--------------------------------------------------------------------
+def _is_chunked(vals) :
+    '''
+    True if vals is not an in-memory numpy array but a lazy
+    column such as merge_hdf5.ChainedColumn, merge_hdf5.CompressedColumn
+    or a memmap
+    (e.g. read_tables with out_path), which should be
+    processed chunk by chunk.
+    '''
+    return not isinstance(vals, np.ndarray) or isinstance(vals, np.memmap)
+
+#--------------------------------------------------------------------
+def _iter_chunks(arrays, chunk_size=CHUNK_SIZE) :
+    '''
+    iterate aligned slices of arrays (numpy arrays or
+    lazy columns that support slicing) by chunk_size rows.
+    '''
+    n = len(arrays[0])
+    for start in range(0, n, chunk_size) :
+        stop = min(start + chunk_size, n)
+        yield [np.asarray(a[start:stop]) for a in arrays]
+
+#--------------------------------------------------------------------
+def minmax(vals) :
+    '''
+    min and max of vals.
+    Lazy columns that know their range (e.g. merge_hdf5.ChainedColumn
+    made with a zone map) answer without reading events, other
+    lazy columns and memmaps are read chunk by chunk.
+    '''
+    if hasattr(vals, "minmax") :
+        return vals.minmax()
+    if not _is_chunked(vals) :
+        return np.min(vals), np.max(vals)
+    vmin = np.inf
+    vmax = -np.inf
+    for [chunk] in _iter_chunks([vals]) :
+        if len(chunk) > 0 :
+            vmin = min(vmin, np.min(chunk))
+            vmax = max(vmax, np.max(chunk))
+    return vmin, vmax
+
+#--------------------------------------------------------------------
+def _make_1D_hist_chunked(xvals, nbins, weights, x_range, xbins) :
+    '''
+    make_1D_hist for lazy columns that may not fit in memory.
+    yval and w2s are accumulated chunk by chunk with the same bins.
+    '''
+    [xmin, xmax] = x_range
+    if len(xbins) > 0 :
+        bins = np.asarray(xbins, dtype=float)
+    else :
+        if (xmin == xmax) :
+            xmin, xmax = minmax(xvals)
+            diff = xmax - xmin
+            xmin -= 0.05*diff
+            xmax += 0.05*diff
+        bins = np.linspace(xmin, xmax, nbins + 1)
+
+    yval = np.zeros(len(bins) - 1)
+    w2s = np.zeros(len(bins) - 1)
+    if len(weights) == 0 :
+        for [x] in _iter_chunks([xvals]) :
+            counts, bins = np.histogram(x, bins=bins)
+            yval += counts
+            w2s += counts
+    else :
+        for x, w in _iter_chunks([xvals, weights]) :
+            yval += np.histogram(x, bins=bins, weights=w)[0]
+            w2s += np.histogram(x, bins=bins, weights=w*w)[0]
+
+    return yval, bins, w2s
+
+
 #--------------------------------------------------------------------
 def make_1D_hist(xvals, nbins=100, weights=[], x_range=[-1, -1], xbins=[]) :
     """
@@ -39,9 +115,17 @@ def make_1D_hist(xvals, nbins=100, weights=[], x_range=[-1, -1], xbins=[]) :
     w2s  : 1D numpy array (size nbins) 
         sum of weight*weight per bin
 
+    If xvals is a lazy column such as merge_hdf5.ChainedColumn,
+    the histogram is filled chunk by chunk without loading
+    whole xvals into memory.
+
     """
+    if _is_chunked(xvals) :
+        return _make_1D_hist_chunked(xvals, nbins, weights, x_range, xbins)
+
     if len(weights) == 0 :
         weights = np.ones(len(xvals))
+    weights = np.asarray(weights)
 
     yval = []
     [xmin, xmax] = x_range
@@ -52,29 +136,14 @@ def make_1D_hist(xvals, nbins=100, weights=[], x_range=[-1, -1], xbins=[]) :
         yval, bins = np.histogram(xvals, bins=xbins, weights=weights)
     else :
         if (xmin == xmax) :
-            xmin = min(xvals.tolist())
-            xmax = max(xvals.tolist())
+            xmin, xmax = minmax(xvals)
             diff = xmax - xmin
             xmin -= 0.05*diff
             xmax += 0.05*diff
         yval, bins = np.histogram(xvals, nbins, weights=weights, range=(xmin,xmax))
 
-    w2s = np.zeros(len(yval))
-    #print yval
-    #print weights 
-
-    # calc weighted errors
-    #print bins
-    for i, v in enumerate(xvals) :
-        if v < xmin or v > xmax :
-            continue
-        index = bisect.bisect_left(bins, v)
-        if index >= len(bins) :
-            print("value is %f, index is %d, binsize is %d" % (v, index, len(bins)))
-        index -= 1
-        #print("v %f index %d binmin %f binmax %f" %(v, index, bins[index], bins[index+1]))
-        w2 = weights[i]**2
-        w2s[index] += w2
+    # sum of weight*weight per bin, filled the same way as yval
+    w2s, bins = np.histogram(xvals, bins=bins, weights=weights*weights)
 
     return yval, bins, w2s
 
@@ -111,7 +180,12 @@ def make_2D_hist(xvals, yvals, nx, ny, weights=[], x_range=[-1,-1], y_range=[-1,
     w2s : sum of weights**2 (2D)
     xbins (1D) = xmeshgrid[0]
     ybins (1D) = ymeshgrid[0]
+    If xvals and yvals are lazy columns such as 
+    merge_hdf5.ChainedColumn, the histogram is filled
+    chunk by chunk without loading them into memory.
     '''
+    if _is_chunked(xvals) or _is_chunked(yvals) :
+        return _make_2D_hist_chunked(xvals, yvals, nx, ny, weights, x_range, y_range)
 
     xmin = x_range[0]
     xmax = x_range[1]
@@ -119,11 +193,9 @@ def make_2D_hist(xvals, yvals, nx, ny, weights=[], x_range=[-1,-1], y_range=[-1,
     ymax = y_range[1]
 
     if (xmin == xmax) :
-        xmin = min(xvals.tolist())
-        xmax = max(xvals.tolist())
+        xmin, xmax = minmax(xvals)
     if (ymin == ymax) :
-        ymin = min(yvals.tolist())
-        ymax = max(yvals.tolist())
+        ymin, ymax = minmax(yvals)
 
     dx = float(xmax - xmin) / nx
     dy = float(ymax - ymin) / ny
@@ -167,6 +239,129 @@ def make_2D_hist(xvals, yvals, nx, ny, weights=[], x_range=[-1,-1], y_range=[-1,
     return xmeshgrid, ymeshgrid, zval, w2s, xmeshgrid[:,0], ymeshgrid[0]
 
 
+#--------------------------------------------------------------------
+def _make_2D_hist_chunked(xvals, yvals, nx, ny, weights, x_range, y_range) :
+    '''
+    make_2D_hist for lazy columns that may not fit in memory.
+    Same binning as make_2D_hist, vectorized per chunk.
+    '''
+    [xmin, xmax] = x_range
+    [ymin, ymax] = y_range
+    if (xmin == xmax) :
+        xmin, xmax = minmax(xvals)
+    if (ymin == ymax) :
+        ymin, ymax = minmax(yvals)
+
+    dx = float(xmax - xmin) / nx
+    dy = float(ymax - ymin) / ny
+    zval = np.zeros(nx * ny)
+    w2s = np.zeros(nx * ny)
+
+    arrays = [xvals, yvals]
+    if len(weights) > 0 :
+        arrays.append(weights)
+    for chunk in _iter_chunks(arrays) :
+        x, y = chunk[0], chunk[1]
+        w = np.ones(len(x))
+        if len(chunk) > 2 :
+            w = chunk[2]
+        cut = (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+        xi = np.minimum(((x[cut] - xmin)/dx).astype(int), nx - 1)
+        yi = np.minimum(((y[cut] - ymin)/dy).astype(int), ny - 1)
+        index = xi * ny + yi
+        zval += np.bincount(index, weights=w[cut], minlength=nx * ny)
+        w2s += np.bincount(index, weights=w[cut]**2, minlength=nx * ny)
+
+    zval = zval.reshape((nx, ny))
+    w2s = w2s.reshape((nx, ny))
+    xmeshgrid, ymeshgrid = get_2DHist_axis(xmin, xmax, ymin, ymax, nx, ny)
+    return xmeshgrid, ymeshgrid, zval, w2s, xmeshgrid[:,0], ymeshgrid[0]
+
+
+#--------------------------------------------------------------------
+class Hist1D() :
+    '''
+    1D histogram with fixed bins that can be filled many times,
+    e.g. with rows of new files from merge_hdf5.FileWatcher.
+    result() returns same values as make_1D_hist of all 
+    filled values.
+    '''
+    def __init__(self, xbins) :
+        self.bins = np.asarray(xbins, dtype=float)
+        self.yval = np.zeros(len(self.bins) - 1)
+        self.w2s = np.zeros(len(self.bins) - 1)
+        self.entries = 0
+        self.sumw = 0.
+        self.sumwx = 0.
+
+    def fill(self, xvals, weights=[]) :
+        '''
+        add xvals (numpy array or lazy column) to the histogram.
+        values are read once, chunk by chunk.
+        '''
+        if len(weights) == 0 :
+            for [x] in _iter_chunks([xvals]) :
+                counts = np.histogram(x, bins=self.bins)[0]
+                self.yval += counts
+                self.w2s += counts
+                self.sumw += len(x)
+                self.sumwx += np.sum(x)
+        else :
+            for x, w in _iter_chunks([xvals, weights]) :
+                self.yval += np.histogram(x, bins=self.bins, weights=w)[0]
+                self.w2s += np.histogram(x, bins=self.bins, weights=w*w)[0]
+                self.sumw += np.sum(w)
+                self.sumwx += np.sum(x*w)
+        self.entries += len(xvals)
+
+    def mean(self) :
+        '''
+        weighted mean of filled values
+        '''
+        return self.sumwx / self.sumw if self.sumw != 0 else 0.
+
+    def result(self) :
+        '''
+        yval, bins, w2s as make_1D_hist
+        '''
+        return self.yval.copy(), self.bins.copy(), self.w2s.copy()
+
+#--------------------------------------------------------------------
+class Hist2D() :
+    '''
+    2D histogram with fixed ranges that can be filled many times.
+    result() returns same values as make_2D_hist of all 
+    filled values.
+    '''
+    def __init__(self, nx, ny, x_range, y_range) :
+        self.nx = nx
+        self.ny = ny
+        self.x_range = list(x_range)
+        self.y_range = list(y_range)
+        self.zval = np.zeros((nx, ny))
+        self.w2s = np.zeros((nx, ny))
+        self.entries = 0
+
+    def fill(self, xvals, yvals, weights=[]) :
+        '''
+        add (xvals, yvals) (numpy arrays or lazy columns) to the histogram
+        '''
+        zval, w2s = _make_2D_hist_chunked(xvals, yvals, self.nx, self.ny, weights,
+                                          self.x_range, self.y_range)[2:4]
+        self.zval += zval
+        self.w2s += w2s
+        self.entries += len(xvals)
+
+    def result(self) :
+        '''
+        xmeshgrid, ymeshgrid, zval, w2s, xbins, ybins as make_2D_hist
+        '''
+        [xmin, xmax] = self.x_range
+        [ymin, ymax] = self.y_range
+        xmeshgrid, ymeshgrid = get_2DHist_axis(xmin, xmax, ymin, ymax, self.nx, self.ny)
+        return xmeshgrid, ymeshgrid, self.zval.copy(), self.w2s.copy(), xmeshgrid[:,0], ymeshgrid[0]
+
+
 #--------------------------------------------------------------------
 def projection(val2d, ax) :
     val_proj = np.sum(val2d, axis=ax)
@@ -1,14 +1,45 @@
 # 
+# requires python 3.7 or later
 import tables
 import numpy as np
 import sys
-if sys.version_info[0] >= 3:
-    import pickle
-else:
-    import cPickle as pickle
+import os
+import json
+import hashlib
+import zlib
+import atexit
+import threading
+import collections
+import time
+import shutil
+import contextlib
+import socket
+import pickle
+import queue
+
+# files smaller than this size [bytes] are regarded as empty
+EMPTY_FILESIZE = 2800
+
+# max number of rows read at once when multiple leaves are requested
+READ_CHUNK_ROWS = 100000
+
+# default max number of h5 files kept open by the shared TablePool
+MAX_OPEN_FILES = 128
+
+# default number of rows in one block of CompressedColumn
+COMPRESS_BLOCK_ROWS = 65536
+
+# claims of shards older than this [sec] are regarded as left by dead jobs
+CLAIM_TIMEOUT = 24*3600
+
+# listings of directories modified within this time [sec] before a scan
+# are not cached, files added later may not change the mtime
+RECENT_MTIME = 5.
 
 #--------------------------------------------------
 import glob
+import fnmatch
+import re
 def glob_filenames(tablelist) :
     """
     Function to generate filename list.
@@ -18,12 +49,14 @@ def glob_filenames(tablelist) :
     tablelist : str
         Could be a name of list file that contains 
         list of h5 files, or a name of h5 file 
-        with wildcard
+        with wildcard, or a directory (h5 files under 
+        it are searched recursively, see discover_files)
 
     Returns
     ----------
     filenames : list
-        list of string(name of h5 files)
+        list of string(name of h5 files), sorted
+        if tablelist contains wildcard or is a directory
     """
 
     if type(tablelist) != str :
@@ -31,11 +64,28 @@ def glob_filenames(tablelist) :
         sys.exit(0)
 
     filenames = []
-    if "*" in tablelist :
+    if "*" in tablelist or "?" in tablelist or "[" in tablelist :
+        '''
+        tablelist contains wildcard. if only the file name 
+        has wildcard, scan the directory, otherwise glob it.
         '''
-        tablelist contains wildcard. glob it.
+        dirname, pattern = os.path.split(tablelist)
+        if glob.has_magic(dirname) :
+            filenames = sorted(glob.glob(tablelist, recursive=True))
+        else :
+            try :
+                filenames = discover_files(dirname or ".", include=pattern, recursive=False)
+            except OSError :
+                # missing or unreadable directory
+                filenames = []
+            if dirname == "" :
+                filenames = [os.path.basename(f) for f in filenames]
+
+    elif os.path.isdir(tablelist) :
+        '''
+        tablelist is a directory. search h5 files in it.
         '''
-        filenames = glob.glob(tablelist)
+        filenames = discover_files(tablelist)
 
     elif ".h5" in tablelist or ".hdf5" in tablelist:
         '''
@@ -50,9 +100,8 @@ def glob_filenames(tablelist) :
         '''
         flist = open(tablelist)
         for i, fname in enumerate(flist):
-            if fname.count("#") :
+            if fname.count("#") or fname.strip() == "" :
                 continue
-            print(fname)
             filenames.append(fname.strip())
         flist.close()
 
@@ -61,6 +110,294 @@ def glob_filenames(tablelist) :
         sys.exit(0)
     return filenames
 
+#--------------------------------------------------
+def _scan_dir(dirname) :
+    """
+    list one directory with os.scandir
+
+    Returns
+    ----------
+    listing : list
+        [mtime, [file names], [subdirectory names]]
+    """
+    mtime = os.stat(dirname).st_mtime
+    files = []
+    subdirs = []
+    for entry in os.scandir(dirname) :
+        try :
+            if entry.is_dir() :
+                subdirs.append(entry.name)
+            else :
+                files.append(entry.name)
+        except OSError :
+            # broken link etc.
+            continue
+    return [mtime, sorted(files), sorted(subdirs)]
+
+#--------------------------------------------------
+def _as_list(patterns) :
+    if patterns is None :
+        return []
+    if isinstance(patterns, str) :
+        return [patterns]
+    return list(patterns)
+
+#--------------------------------------------------
+def _match(name, patterns) :
+    """
+    fnmatch against any of patterns. As glob does, a name 
+    starting with "." matches only a pattern starting with "."
+    """
+    for p in patterns :
+        if name.startswith(".") and not p.startswith(".") :
+            continue
+        if fnmatch.fnmatch(name, p) :
+            return True
+    return False
+
+#--------------------------------------------------
+def discover_files(topdirs, include=("*.h5", "*.hdf5"), exclude=None, regex=None, 
+                   recursive=True, workers=8, cachefile=None) :
+    """
+    Find files under directories with os.scandir.
+    Directories are listed in parallel threads, which 
+    hides the latency of network file systems. 
+
+    Parameters
+    ----------
+    topdirs : str or list of str
+        directories to search
+
+    include : str or list of str
+        glob patterns of file names to accept, e.g. "Level2_*.h5".
+        Hidden files (".foo.h5") are accepted only by patterns
+        starting with "."
+
+    exclude : str or list of str
+        glob patterns of file names or directory names
+        to skip, e.g. ["*_IT.h5", "logs"]
+
+    regex : str
+        if given, only files whose full path matches 
+        (re.search) are accepted
+
+    recursive : bool
+        if True, subdirectories are searched too
+
+    workers : int
+        number of threads to list directories
+
+    cachefile : str
+        if given, listings of directories are saved in this
+        json file with mtimes of the directories. In later 
+        calls, a directory whose mtime is not changed is 
+        not listed again (only stat is called).
+        Directories modified just before the scan are not
+        saved (see RECENT_MTIME).
+
+    Links to directories are followed, and each directory
+    is listed once even if it's reached by several paths.
+
+    Returns
+    ----------
+    filenames : list of str
+        sorted list of paths
+    """
+    includes = _as_list(include)
+    excludes = _as_list(exclude)
+    pattern = re.compile(regex) if regex is not None else None
+
+    cache = {}
+    if cachefile is not None and os.path.exists(cachefile) :
+        with open(cachefile) as f :
+            cache = json.load(f)
+
+    def listing(dirname) :
+        st = os.stat(dirname)
+        cached = cache.get(dirname)
+        if cached is not None and cached[0] == st.st_mtime :
+            return (st.st_dev, st.st_ino), cached
+        return (st.st_dev, st.st_ino), _scan_dir(dirname)
+
+    started = time.time()
+    listings = {}
+    visited = set() # (st_dev, st_ino) of listed directories, links may make loops
+    from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor :
+        pending = dict([(executor.submit(listing, d), d) for d in _as_list(topdirs)])
+        while len(pending) > 0 :
+            done, rest = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done :
+                dirname = pending.pop(future)
+                key, listings[dirname] = future.result()
+                if key in visited :
+                    del listings[dirname]
+                    continue
+                visited.add(key)
+                if not recursive :
+                    continue
+                for subdir in listings[dirname][2] :
+                    if any([fnmatch.fnmatch(subdir, p) for p in excludes]) :
+                        continue
+                    subdir = os.path.join(dirname, subdir)
+                    pending[executor.submit(listing, subdir)] = subdir
+
+    filenames = []
+    for dirname, (mtime, files, subdirs) in listings.items() :
+        for fname in files :
+            if len(includes) > 0 and not _match(fname, includes) :
+                continue
+            if any([fnmatch.fnmatch(fname, p) for p in excludes]) :
+                continue
+            path = os.path.join(dirname, fname)
+            if pattern is not None and not pattern.search(path) :
+                continue
+            filenames.append(path)
+
+    if cachefile is not None :
+        cache.update([(d, l) for d, l in listings.items() if l[0] < started - RECENT_MTIME])
+        save_manifest(cache, cachefile)
+    return sorted(filenames)
+
+#--------------------------------------------------
+class TablePool() :
+    """
+    Bounded pool of opened h5 files with LRU eviction.
+    get(fname) returns a warm handle if the file is already
+    opened, otherwise opens it and closes the least recently
+    used one if more than max_open files are opened.
+    A handle is reopened if the file is modified on disk.
+    Handles obtained from the pool must not be closed by 
+    the caller, and may be closed by eviction after other
+    files are requested.
+
+    Usage:
+        with TablePool(max_open=32) as pool :
+            buf = read_tables(files, "MCPrimary", "energy", pool=pool)
+
+    If pool is not given, functions in this module open
+    files in a temporary pool that is closed when the function
+    returns, so no file is left open. Give a pool (e.g. the
+    shared one, see get_pool) to keep handles warm across calls.
+    """
+    def __init__(self, max_open=MAX_OPEN_FILES) :
+        self.max_open = max_open
+        self.handles = collections.OrderedDict() # {abspath: [h5 object, size, mtime]}
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, fname) :
+        key = os.path.abspath(fname)
+        st = os.stat(key)
+        with self.lock :
+            item = self.handles.pop(key, None)
+            if item is not None and item[0].isopen and \
+               item[1] == st.st_size and item[2] == st.st_mtime :
+                self.hits += 1
+            else :
+                if item is not None and item[0].isopen :
+                    item[0].close()
+                self.misses += 1
+                item = [tables.open_file(key), st.st_size, st.st_mtime]
+            self.handles[key] = item
+            self._evict()
+            return item[0]
+
+    def _evict(self) :
+        while len(self.handles) > max(self.max_open, 1) :
+            key, item = self.handles.popitem(last=False)
+            if item[0].isopen :
+                item[0].close()
+
+    def resize(self, max_open) :
+        with self.lock :
+            self.max_open = max_open
+            self._evict()
+
+    def release(self, fname) :
+        """
+        close the file if it's opened in the pool
+        """
+        with self.lock :
+            item = self.handles.pop(os.path.abspath(fname), None)
+            if item is not None and item[0].isopen :
+                item[0].close()
+
+    def close(self) :
+        """
+        close all files in the pool
+        """
+        with self.lock :
+            while len(self.handles) > 0 :
+                key, item = self.handles.popitem(last=False)
+                if item[0].isopen :
+                    item[0].close()
+
+    def __len__(self) :
+        return len(self.handles)
+
+    def __contains__(self, fname) :
+        return os.path.abspath(fname) in self.handles
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, *args) :
+        self.close()
+
+_pool = TablePool()
+atexit.register(_pool.close)
+
+#--------------------------------------------------
+def get_pool() :
+    """
+    get the shared TablePool. Give it as pool to keep 
+    files open across calls, e.g.
+    read_tables(files, "MCPrimary", "energy", pool=get_pool())
+    """
+    return _pool
+
+#--------------------------------------------------
+def set_max_open_files(max_open) :
+    """
+    set max number of h5 files kept open by the shared TablePool
+    """
+    _pool.resize(max_open)
+
+#--------------------------------------------------
+def _scoped_pool(pool) :
+    """
+    pool for one call of a function, use it as
+        with _scoped_pool(pool) as pool : ...
+    If pool is None, a new TablePool is made and all files
+    opened in it are closed at the end of the with block,
+    otherwise the given pool is used and left open.
+    """
+    if pool is None :
+        return TablePool()
+    return contextlib.nullcontext(pool)
+
+#--------------------------------------------------
+def _handle(src, pool) :
+    """
+    get opened h5 object of src.
+
+    Parameters
+    ----------
+    src : str or opened h5 object
+        filenames and h5 objects closed by pool eviction
+        are (re)opened through the pool.
+
+    pool : TablePool
+        pool to open files
+    """
+    if isinstance(src, str) :
+        return pool.get(src)
+    if not src.isopen :
+        return pool.get(src.filename)
+    return src
+
 #--------------------------------------------------
 def load_a_table(fname) :
     """
@@ -83,7 +420,7 @@ def load_a_table(fname) :
 
 
 #--------------------------------------------------
-def load_tables(filelist) :
+def load_tables(filelist, pool=None) :
     """
     loading all tables listed in the filelist
 
@@ -94,6 +431,11 @@ def load_tables(filelist) :
         list of h5 files, or a name of h5 file 
         with wildcard
 
+    pool : TablePool
+        if given, files are opened through the pool.
+        Then handles may be closed by LRU eviction, and 
+        functions in this module reopen them transparently.
+
     Returns
     ----------
     tablelist : list
@@ -102,7 +444,10 @@ def load_tables(filelist) :
     tablelist = []
     filenames = glob_filenames(filelist)
     for i, fname in enumerate(filenames) :
-        myt = tables.open_file(fname)
+        if pool is None :
+            myt = tables.open_file(fname)
+        else :
+            myt = pool.get(fname)
         tablelist.append(myt)
 
     print("tablelist %s is successfully loaded" % (filelist))
@@ -123,232 +468,4138 @@ def close_tables(tablelist) :
     print("tablelist %s is successfully closed" % (tablelist))
 
 #--------------------------------------------------
-def check_tables(tablelist, nodename, leafname) :
+def check_tables(tablelist, nodename, leafname, pool=None) :
     """
     function to check whether the nodename and leafname exist
     in tables or not.
     if succeed, it returns number of tables.
     if failed it returns -1.
+    If tablelist is a manifest made with build_manifest,
+    no file is opened.
+    If tablelist is string, files are opened through pool,
+    if pool is None they are closed before returning.
     """
     if nodename[0] != "/" :
         nodename = "/%s" % nodename
 
     nfiles = 0
-    if type(tablelist) == str :
+    if _is_manifest(tablelist) :
         '''
-        tablelist is not loaded yet. load tables first
-        and check nodename and leafname.
-        ''' 
-        filenames = glob_filenames(tablelist)
-        for i, fname in enumerate(filenames):
-            myt = tables.open_file(fname)
-            if not nodename in myt :
+        tablelist is a manifest. check it without
+        opening files.
+        '''
+        for entry in tablelist["files"] :
+            if not nodename in entry["nodes"] :
                 print("nodename %s does not exist." % (nodename))
-                myt.close()
                 return -1
-
-            node = myt.get_node(nodename)
-            if not leafname in node.colnames :
+            if not leafname in entry["nodes"][nodename]["leaves"] :
                 print("leafname %s does not exist." % (leafname))
-                myt.close()
                 return -1
-            myt.close()
             nfiles = nfiles + 1
         return nfiles
 
+    elif type(tablelist) == str :
+        '''
+        tablelist is not loaded yet. load tables first
+        and check nodename and leafname.
+        ''' 
+        filenames = glob_filenames(tablelist)
+        with _scoped_pool(pool) as pool :
+            for i, fname in enumerate(filenames):
+                myt = _handle(fname, pool)
+                if not nodename in myt :
+                    print("nodename %s does not exist." % (nodename))
+                    return -1
+
+                node = myt.get_node(nodename)
+                if not leafname in node.colnames :
+                    print("leafname %s does not exist." % (leafname))
+                    return -1
+                nfiles = nfiles + 1
+        return nfiles
+
     else :
         '''
         tablelist is a list of tables
         ''' 
-        for myt in tablelist:
-            if not nodename in myt :
-                print("nodename %s does not exist." % (nodename))
-                return False
+        with _scoped_pool(pool) as pool :
+            for myt in tablelist:
+                myt = _handle(myt, pool)
+                if not nodename in myt :
+                    print("nodename %s does not exist." % (nodename))
+                    return False
 
-            node = myt.get_node(nodename)
-            if not leafname in node.colnames :
-                print("leafname %s does not exist." % (leafname))
-                return False
+                node = myt.get_node(nodename)
+                if not leafname in node.colnames :
+                    print("leafname %s does not exist." % (leafname))
+                    return False
 
-            nfiles = nfiles + 1
+                nfiles = nfiles + 1
         return nfiles
 
 #--------------------------------------------------
-def check_leaf(tablelist, nodename, leafname) :
+def check_leaf(tablelist, nodename, leafname, pool=None) :
     """
     function to check whether the nodename and leafname exist
     in tables or not.
     It checks the first table only.
     To check whole tables, use check_tables.
+    If tablelist is a manifest made with build_manifest,
+    no file is opened.
+    If tablelist is string, the file is opened through pool,
+    if pool is None it is closed before returning.
     """
     if nodename[0] != "/" :
         nodename = "/%s" % nodename
 
-    if type(tablelist) == str :
+    if _is_manifest(tablelist) :
+        '''
+        tablelist is a manifest. check it without
+        opening files.
+        '''
+        nodes = tablelist["files"][0]["nodes"]
+        if not nodename in nodes :
+            return False
+        return leafname in nodes[nodename]["leaves"]
+
+    elif type(tablelist) == str :
         '''
         tablelist is not loaded yet. load tables first
         and check nodename and leafname.
         ''' 
         filenames = glob_filenames(tablelist)
-        myt = tables.open_file(filenames[0])
-        if not nodename in myt :
-            myt.close()
-            return False
+        with _scoped_pool(pool) as pool :
+            myt = _handle(filenames[0], pool)
+            if not nodename in myt :
+                return False
 
-        node = myt.get_node(nodename)
-        if not leafname in node.colnames :
-            myt.close()
-            return False
-        myt.close()
-        return True
+            node = myt.get_node(nodename)
+            if not leafname in node.colnames :
+                return False
+            return True
 
     else :
         '''
         tablelist is a list of tables
         ''' 
-        myt = tablelist[0]
-        if not nodename in myt :
-            return False
+        with _scoped_pool(pool) as pool :
+            myt = _handle(tablelist[0], pool)
+            if not nodename in myt :
+                return False
 
-        node = myt.get_node(nodename)
-        if not leafname in node.colnames :
-            return False
+            node = myt.get_node(nodename)
+            if not leafname in node.colnames :
+                return False
 
-        return True
+            return True
 
 #--------------------------------------------------
-def read_tables(tablelist, nodename, leafname) :
+def _checksum(fname, blocksize=1<<20) :
     """
-    Read data named leafname from tables and merge 
-    them to one (n, 1) array
-    If tablelist is string, it leads only one table 
-    at a time and append the data to a buffer.
+    adler32 checksum of the whole file as hex string
+    """
+    value = 1
+    with open(fname, "rb") as f :
+        block = f.read(blocksize)
+        while block :
+            value = zlib.adler32(block, value)
+            block = f.read(blocksize)
+    return "%08x" % (value & 0xffffffff)
+
+#--------------------------------------------------
+def _scan_file(fname, checksum=True) :
+    """
+    Make a manifest entry of one h5 file.
+
+    Returns
+    ----------
+    entry : dict
+        {"name" : absolute path, "size" : bytes, "mtime" : mtime,
+         "checksum" : adler32 hex or None, "empty" : bool,
+         "nodes" : {nodename: {"nrows" : n, 
+                               "leaves" : {leafname: [dtype, shape]}}}}
+    """
+    st = os.stat(fname)
+    entry = {"name" : os.path.abspath(fname),
+             "size" : st.st_size,
+             "mtime" : st.st_mtime,
+             "checksum" : None,
+             "empty" : st.st_size < EMPTY_FILESIZE,
+             "nodes" : {}}
+    if checksum :
+        entry["checksum"] = _checksum(fname)
+
+    with TablePool() as pool :
+        myt = _handle(fname, pool)
+        for node in myt.walk_nodes("/", "Table") :
+            leaves = {}
+            for leafname, coltype in node.coldtypes.items() :
+                leaves[leafname] = [coltype.base.str, list(coltype.shape)]
+            entry["nodes"][node._v_pathname] = {"nrows" : int(node.nrows), "leaves" : leaves}
+    return entry
+
+#--------------------------------------------------
+def _checked_entry(entry) :
+    """
+    Return the manifest entry if size and mtime of the file
+    are not changed, otherwise the entry of rescanned file.
+    """
+    st = os.stat(entry["name"])
+    if st.st_size == entry["size"] and st.st_mtime == entry["mtime"] :
+        return entry
+    print("manifest: %s is modified after the manifest was made, rescanned" % (entry["name"]))
+    return _scan_file(entry["name"], checksum=False)
+
+#--------------------------------------------------
+def build_manifest(tablelist, manifest=None, checksum=True, workers=0) :
+    """
+    Scan h5 files once and make a manifest that records
+    node/leaf schemas, dtypes, number of rows of each node,
+    file sizes, mtimes, checksums and empty-file flags.
+    A manifest can be given to check_tables, check_leaf,
+    read_tables and read_tables_multi in place of tablelist,
+    then schema checks, allocation sizing and empty-file 
+    skipping are done without opening h5 files.
 
     Parameters
     ----------
-    tablelist : str or list of tables
-        filename of list of h5 files or 
-        filename that contains wildcard or
-        list of opened h5 objects stored with load_tables
+    tablelist : str or list of tables or list of str
+        same as read_tables
 
-    nodename : str
-        name of branch of h5 file
+    manifest : dict
+        previous manifest. files whose size and mtime are 
+        not changed are not scanned again.
 
-    leafname : str
-        name of leaf of h5 file
+    checksum : bool
+        if False, checksums are not calculated (faster)
+
+    workers : int
+        if larger than 1, files are scanned by this number 
+        of worker processes
 
     Returns
     ----------
-    buf : (n, 1) numpy array
+    manifest : dict
+        {"files" : [entry, ...]}, see _scan_file for entry
 
     """
+    known = {}
+    if manifest is not None :
+        for entry in manifest["files"] :
+            known[entry["name"]] = entry
 
-    buf = "notyetfilled" # dummy
-    if nodename[0] != "/" :
-        nodename = "/%s" % nodename
-
-    if isinstance(tablelist, str) :
-        '''
-        load one h5 table at a time, slow but 
-        uses less runtime memory
-        '''
-        filenames = glob_filenames(tablelist) 
-        for i, fname in enumerate(filenames):
-            #print("open file %s" % (fname))
-            if fname[0] == "#" :
-                continue
-            myt = tables.open_file(fname)
-            filesize = myt.get_filesize()
-            if filesize < 2800 :
-                # this is empty file. skip it.
+    entries = []
+    scans = []
+    for fname in _filenames(tablelist) :
+        entry = known.get(os.path.abspath(fname))
+        if entry is not None :
+            st = os.stat(fname)
+            if entry["size"] == st.st_size and entry["mtime"] == st.st_mtime and \
+               (entry["checksum"] is not None or not checksum) :
+                entries.append(entry)
                 continue
+        entries.append(None)
+        scans.append((len(entries) - 1, fname))
 
-            if isinstance(buf, str) :
-                buf = myt.get_node(nodename).col(leafname)
-                
-            else :
-                buf = np.hstack((buf, myt.get_node(nodename).col(leafname)))
+    arglist = [(fname, checksum) for i, fname in scans]
+    if workers > 1 :
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor :
+            for (i, fname), entry in zip(scans, _imap(executor, _scan_file, arglist, 4*workers)) :
+                entries[i] = entry
+    else :
+        for (i, fname), args in zip(scans, arglist) :
+            entries[i] = _scan_file(*args)
 
-            #myt.close()
+    print("manifest: %d files, %d scanned" % (len(entries), len(scans)))
+    return {"files" : entries}
 
-    else :
-        '''
-        tablelist is list of tables filled with 
-        load_tables.
-        fast, but uses more runtime memory
-        '''
-        for i, t in enumerate(tablelist):
-            #print i, t
-            filesize = tablelist[i].get_filesize()
-            if filesize < 2800 :
-                # this is empty file. skip it.
-                continue
-     
-            if i == 0 :
-                buf=tablelist[i].get_node(nodename).col(leafname)
-            else :
-                buf = np.hstack((buf, tablelist[i].get_node(nodename).col(leafname)))
+#--------------------------------------------------
+def save_manifest(manifest, fname) :
+    """
+    save manifest as a json file
+    """
+    tmpname = "%s.%d.tmp" % (fname, os.getpid())
+    with open(tmpname, "w") as f :
+        json.dump(manifest, f)
+    os.rename(tmpname, fname)
 
-    #print nodename, leafname, buf.shape
-    return buf
+#--------------------------------------------------
+def load_manifest(fname) :
+    """
+    load manifest saved with save_manifest
+    """
+    with open(fname) as f :
+        return json.load(f)
 
 #--------------------------------------------------
-def read_pickles(tablelist, leafname) :
+def update_manifest(fname, tablelist, checksum=True, workers=0) :
     """
-    Read data named leafname from dictionaries and merge 
-    them to one (n, 1) array
-    If tablelist is string, it leads only one dictionary
-    at a time and append the data to a buffer.
+    Refresh the manifest file incrementally.
+    If fname exists, only new or modified files are scanned,
+    and files no longer in tablelist are dropped.
+    The refreshed manifest is saved to fname and returned.
+    """
+    manifest = None
+    if os.path.exists(fname) :
+        manifest = load_manifest(fname)
+    manifest = build_manifest(tablelist, manifest, checksum, workers)
+    save_manifest(manifest, fname)
+    return manifest
 
-    Parameters
-    ----------
-    tablelist : str or list of tables
-        filename of list of pickles files or 
-        filename that contains wildcard or
-        list of opened dictionaries 
+#--------------------------------------------------
+def _is_manifest(tablelist) :
+    return isinstance(tablelist, dict) and "files" in tablelist
 
-    leafname : str
-        name of key of dictionary
+#--------------------------------------------------
+def _manifest_node(entry, nodename) :
+    """
+    get node info of the manifest entry, 
+    raise NoSuchNodeError as tables.File.get_node does.
+    """
+    if not nodename in entry["nodes"] :
+        raise tables.NoSuchNodeError("%s does not have node %s" % (entry["name"], nodename))
+    return entry["nodes"][nodename]
+
+#--------------------------------------------------
+def _zonemap_file(fname, paths) :
+    """
+    Make a zone map entry of one h5 file.
 
     Returns
     ----------
-    buf : (n, 1) numpy array
+    entry : dict
+        {"name" : absolute path, "size" : bytes, "mtime" : mtime,
+         "stats" : {nodename: {leafname: [min, max, count, sum]}}}
+        stats of empty files are {}, NaN are ignored in 
+        min, max and sum, and a leaf without finite values
+        has [None, None, count, 0].
+    """
+    st = os.stat(fname)
+    entry = {"name" : os.path.abspath(fname),
+             "size" : st.st_size,
+             "mtime" : st.st_mtime,
+             "stats" : {}}
+    if st.st_size < EMPTY_FILESIZE :
+        return entry
 
+    with TablePool() as pool :
+        myt = _handle(fname, pool)
+        for nodename, leafnames in paths.items() :
+            node = myt.get_node(nodename)
+            bufs = _allocate_leaves(node, leafnames, node.nrows)
+            _read_node(node, leafnames, bufs, 0)
+            stats = {}
+            for leafname in leafnames :
+                buf = bufs[leafname]
+                if buf.dtype.kind == "b" :
+                    buf = buf.astype(int)
+                finite = buf[~np.isnan(buf)] if buf.dtype.kind == "f" else buf
+                if finite.size == 0 :
+                    stats[leafname] = [None, None, int(buf.size), 0]
+                else :
+                    stats[leafname] = [finite.min().item(), finite.max().item(), 
+                                       int(buf.size), finite.sum().item()]
+            entry["stats"][nodename] = stats
+    return entry
+
+#--------------------------------------------------
+def build_zonemap(tablelist, leaves, zonemap=None, workers=0) :
     """
+    Record min, max, count and sum of leaves for each file.
+    The zone map is a small json-able index, so range queries
+    can skip files whose ranges don't overlap (see prune_files)
+    and histograms can get ranges without reading events
+    (see zonemap_stats and chain_tables).
 
-    buf = "notyetfilled" # dummy
+    Parameters
+    ----------
+    tablelist : str or list of tables or list of str or dict
+        same as read_tables
 
-    if isinstance(tablelist, str) :
-        '''
-        load one pickle at a time, slow but 
-        uses less runtime memory
-        '''
-        filenames = glob_filenames(tablelist) 
-        for i, fname in enumerate(filenames):
-            #print("open file %s" % (fname))
-            myt = pickle.load(open(fname))
-            if isinstance(buf, str) :
-                buf = myt[leafname]
-                
-            else :
-                buf = np.hstack((buf, myt[leafname]))
+    leaves : dict
+        {nodename: [leafname, ...]}
+
+    zonemap : dict
+        previous zone map. files whose size and mtime are
+        not changed and which have stats of all leaves are
+        not read again.
+
+    workers : int
+        if larger than 1, files are read by this number 
+        of worker processes
 
+    Returns
+    ----------
+    zonemap : dict
+        {"files" : [entry, ...]}, see _zonemap_file for entry
+
+    """
+    paths = dict([(_nodepath(n), list(l)) for n, l in leaves.items()])
+    known = {}
+    if zonemap is not None :
+        for entry in zonemap["files"] :
+            known[entry["name"]] = entry
 
+    entries = []
+    scans = []
+    arglist = []
+    for fname in _filenames(tablelist) :
+        entry = known.get(os.path.abspath(fname))
+        filepaths = paths
+        if entry is not None :
+            st = os.stat(fname)
+            if entry["size"] == st.st_size and entry["mtime"] == st.st_mtime :
+                if entry["size"] < EMPTY_FILESIZE or \
+                   all([set(l) <= set(entry["stats"].get(n, {})) for n, l in paths.items()]) :
+                    entries.append(entry)
+                    continue
+                # new leaves are requested, keep the old ones too
+                filepaths = dict([(n, list(l)) for n, l in entry["stats"].items()])
+                for nodename, leafnames in paths.items() :
+                    leaflist = filepaths.setdefault(nodename, [])
+                    leaflist += [l for l in leafnames if not l in leaflist]
+        entries.append(None)
+        scans.append((len(entries) - 1, fname))
+        arglist.append((fname, filepaths))
+
+    if workers > 1 :
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor :
+            for (i, fname), entry in zip(scans, _imap(executor, _zonemap_file, arglist, 4*workers)) :
+                entries[i] = entry
     else :
-        '''
-        tablelist is list of dictionary filled with 
-        load_tables.
-        fast, but uses more runtime memory
-        '''
-        for i, t in enumerate(tablelist):
-            #print i, t
-            if i == 0 :
-                buf=tablelist[i][leafname]
-            else :
-                buf = np.hstack((buf, tablelist[i][leafname]))
+        for (i, fname), args in zip(scans, arglist) :
+            entries[i] = _zonemap_file(*args)
 
-    print( leafname, buf.shape)
+    print("zonemap: %d files, %d read" % (len(entries), len(scans)))
+    return {"files" : entries}
 
-    return buf
+#--------------------------------------------------
+def update_zonemap(fname, tablelist, leaves, workers=0) :
+    """
+    Refresh the zone map file incrementally, 
+    same as update_manifest.
+    """
+    zonemap = None
+    if os.path.exists(fname) :
+        zonemap = load_manifest(fname)
+    zonemap = build_zonemap(tablelist, leaves, zonemap, workers)
+    save_manifest(zonemap, fname)
+    return zonemap
+
+#--------------------------------------------------
+def _zonemap_changed(entry) :
+    """
+    True if the file of the zone map entry is modified or
+    removed after the entry was made, then its stats are
+    regarded as unknown.
+    """
+    try :
+        st = os.stat(entry["name"])
+    except OSError :
+        st = None
+    if st is not None and st.st_size == entry["size"] and st.st_mtime == entry["mtime"] :
+        return False
+    print("zonemap: %s is modified after the zone map was made, stats are not used" % (entry["name"]))
+    return True
 
+#--------------------------------------------------
+def zonemap_stats(zonemap, nodename, leafname, filenames=None) :
+    """
+    Combine stats of a leaf over files of the zone map.
 
+    Parameters
+    ----------
+    filenames : list of str
+        if given, only these files are combined.
+
+    Returns
+    ----------
+    stats : list
+        [min, max, count, sum], min and max are None 
+        if there is no value.
+    """
+    nodename = _nodepath(nodename)
+    if filenames is not None :
+        filenames = set([os.path.abspath(f) for f in filenames])
+    vmin = None
+    vmax = None
+    count = 0
+    total = 0
+    for entry in zonemap["files"] :
+        if filenames is not None and not entry["name"] in filenames :
+            continue
+        if not nodename in entry["stats"] :
+            continue
+        emin, emax, ecount, esum = entry["stats"][nodename][leafname]
+        count += ecount
+        total += esum
+        if emin is None :
+            continue
+        vmin = emin if vmin is None else min(vmin, emin)
+        vmax = emax if vmax is None else max(vmax, emax)
+    return [vmin, vmax, count, total]
+
+#--------------------------------------------------
+def prune_files(zonemap, ranges) :
+    """
+    Select files that may have rows in ranges.
+
+    Parameters
+    ----------
+    zonemap : dict
+        return value of build_zonemap
+
+    ranges : dict
+        {(nodename, leafname): (low, high)}, low or high 
+        may be None for open ends.
+        e.g. log10(energy) in [6, 7] is
+        {("MCPrimary", "energy"): (1e6, 1e7)}
+
+    Returns
+    ----------
+    filenames : list of str
+        files whose [min, max] overlap all ranges.
+        Empty files and files without values are dropped.
+        Files modified after the zone map was made are kept,
+        as their ranges are unknown.
+        Use it as tablelist with where to select rows.
+    """
+    ranges = dict([((_nodepath(n), l), r) for (n, l), r in ranges.items()])
+    filenames = []
+    for entry in zonemap["files"] :
+        if _zonemap_changed(entry) :
+            filenames.append(entry["name"])
+            continue
+        keep = True
+        for (nodename, leafname), (low, high) in ranges.items() :
+            stats = entry["stats"].get(nodename)
+            if stats is None or stats[leafname][0] is None :
+                keep = False
+                break
+            vmin, vmax = stats[leafname][:2]
+            if (low is not None and vmax < low) or (high is not None and vmin > high) :
+                keep = False
+                break
+        if keep :
+            filenames.append(entry["name"])
+    return filenames
+
+#--------------------------------------------------
+def _nodepath(nodename) :
+    """
+    make sure that nodename starts with "/"
+    """
+    if nodename[0] != "/" :
+        nodename = "/%s" % nodename
+    return nodename
+
+#--------------------------------------------------
+def _filenames(tablelist) :
+    """
+    Get list of h5 filenames from any form of tablelist.
+
+    Parameters
+    ----------
+    tablelist : str or list of tables or list of str
+        same as read_tables
+
+    Returns
+    ----------
+    filenames : list of str
+    """
+    if isinstance(tablelist, str) :
+        return [f for f in glob_filenames(tablelist) if f[0] != "#"]
+    if _is_manifest(tablelist) :
+        return [e["name"] for e in tablelist["files"]]
+    return [t if isinstance(t, str) else t.filename for t in tablelist]
+
+#--------------------------------------------------
+def _count_file_rows(src, nodenames, pool=None) :
+    """
+    Count number of rows of each node in one file.
+
+    Parameters
+    ----------
+    src : str or opened h5 object
+        if str, the file is opened through pool.
+        if pool is None, it is closed before returning.
+
+    Returns
+    ----------
+    nrows : dict or None
+        {nodename: nrows}, None if the file is empty.
+    """
+    with _scoped_pool(pool) as pool :
+        myt = _handle(src, pool)
+        nrows = None
+        if myt.get_filesize() >= EMPTY_FILESIZE :
+            nrows = dict([(n, myt.get_node(n).nrows) for n in nodenames])
+    return nrows
+
+#--------------------------------------------------
+def _imap(executor, func, arglist, depth) :
+    """
+    Same as executor.map but keeps at most depth tasks
+    in flight, so that finished results don't pile up
+    in memory. Results are yielded in the order of arglist.
+    func must be a module level function so that it can be
+    sent to worker processes.
+    """
+    futures = collections.deque()
+    for args in arglist :
+        futures.append(executor.submit(func, *args))
+        if len(futures) >= depth :
+            yield futures.popleft().result()
+    while futures :
+        yield futures.popleft().result()
+
+#--------------------------------------------------
+def _count_rows(tablelist, nodenames, executor=None, depth=1, pool=None) :
+    """
+    First pass of the two-pass reader.
+    Collect number of rows of each node from every table
+    so that the output buffers can be allocated only once.
+
+    Parameters
+    ----------
+    tablelist : str or list of tables or list of str or dict
+        same as read_tables. If manifest is given, files are only
+        stat-ed, and rescanned if modified after the manifest was made.
+
+    nodenames : list of str
+        names of branches of h5 file, must start with "/"
+
+    executor : concurrent.futures.Executor
+        if given, files are opened in worker processes.
+        used only if tablelist is given as filenames.
+
+    depth : int
+        max number of tasks in flight for executor
+
+    pool : TablePool
+        pool to open files. if None, each file is
+        opened and closed while counting.
+
+    Returns
+    ----------
+    sources : list
+        list of [fname or table, {nodename: nrows}] 
+        of non-empty tables
+
+    """
+    if _is_manifest(tablelist) :
+        sources = []
+        for entry in tablelist["files"] :
+            entry = _checked_entry(entry)
+            if not entry["empty"] :
+                nrows = dict([(n, _manifest_node(entry, n)["nrows"]) for n in nodenames])
+                sources.append([entry["name"], nrows])
+        return sources
+
+    if isinstance(tablelist, str) :
+        tablelist = _filenames(tablelist)
+
+    arglist = [(t, nodenames) for t in tablelist]
+    if executor is not None and all([isinstance(t, str) for t in tablelist]) :
+        counts = _imap(executor, _count_file_rows, arglist, depth)
+    else :
+        counts = [_count_file_rows(t, nodenames, pool) for t in tablelist]
+
+    sources = []
+    for src, nrows in zip(tablelist, counts) :
+        if nrows is not None :
+            sources.append([src, nrows])
+    return sources
+
+#--------------------------------------------------
+def _counted_rows(node, nrows) :
+    """
+    Check that node still has nrows rows counted in the
+    first pass and return nrows.
+    """
+    if node.nrows < nrows :
+        raise ValueError("%s of %s has %d rows, %d rows are counted" % 
+                         (node._v_pathname, node._v_file.filename, node.nrows, nrows))
+    return nrows
+
+#--------------------------------------------------
+def _read_node(node, leafnames, outs, start, coords=None, nrows=None) :
+    """
+    Read rows of one node once and scatter the requested
+    leaves into the output buffers.
+
+    Parameters
+    ----------
+    node : tables.Table
+        opened node
+
+    leafnames : list of str
+        names of leaves to be read
+
+    outs : dict
+        {leafname: output buffer}, if dtype of a buffer differs
+        from the one on disk, values are cast while filling.
+
+    start : int
+        first index of the output buffers to be filled
+
+    coords : numpy array
+        if given, only rows at these coordinates are read
+
+    nrows : int
+        number of rows counted in the first pass. rows
+        appended after counting are not read.
+        if None, all rows of node are read.
+    """
+    if coords is not None :
+        _read_node_coordinates(node, leafnames, outs, start, coords)
+        return
+
+    if nrows is None :
+        nrows = node.nrows
+    nrows = _counted_rows(node, nrows)
+    if nrows == 0 :
+        return
+
+    if len(leafnames) == 1 :
+        leafname = leafnames[0]
+        if outs[leafname].dtype == node.coldtypes[leafname].base :
+            node.read(0, nrows, field=leafname, out=outs[leafname][start:start+nrows])
+            return
+
+    # read by chunks, values are cast to dtype of outs on assignment
+    for first in range(0, nrows, READ_CHUNK_ROWS) :
+        last = min(first + READ_CHUNK_ROWS, nrows)
+        if len(leafnames) == 1 :
+            rows = {leafnames[0] : node.read(first, last, field=leafnames[0])}
+        else :
+            rows = node.read(first, last)
+        for leafname in leafnames :
+            outs[leafname][start+first:start+last] = rows[leafname]
+
+#--------------------------------------------------
+def _read_node_coordinates(node, leafnames, outs, start, coords) :
+    """
+    _read_node for selected rows.
+    """
+    nrows = len(coords)
+    if nrows == 0 :
+        return
+
+    if len(leafnames) == 1 :
+        leafname = leafnames[0]
+        outs[leafname][start:start+nrows] = node.read_coordinates(coords, field=leafname)
+        return
+
+    for first in range(0, nrows, READ_CHUNK_ROWS) :
+        last = min(first + READ_CHUNK_ROWS, nrows)
+        rows = node.read_coordinates(coords[first:last])
+        for leafname in leafnames :
+            outs[leafname][start+first:start+last] = rows[leafname]
+
+#--------------------------------------------------
+def _select_file_rows(src, nodenames, wherenode, where, condvars=None, pool=None) :
+    """
+    Evaluate the selection in one file with in-kernel query.
+
+    Returns
+    ----------
+    coords : numpy array or None
+        coordinates of selected rows, None if the file is empty.
+    """
+    with _scoped_pool(pool) as pool :
+        myt = _handle(src, pool)
+        coords = None
+        if myt.get_filesize() >= EMPTY_FILESIZE :
+            node = myt.get_node(wherenode)
+            for nodename in nodenames :
+                if myt.get_node(nodename).nrows != node.nrows :
+                    raise ValueError("%s: %s and %s have different number of rows" 
+                                     % (myt.filename, nodename, wherenode))
+            coords = node.get_where_list(where, condvars=condvars)
+    return coords
+
+#--------------------------------------------------
+def _select_rows(tablelist, nodenames, wherenode, where, condvars=None, executor=None, depth=1, pool=None) :
+    """
+    First pass of the two-pass reader with a selection.
+    Evaluate where in each file and keep coordinates of
+    the selected rows, so that the output buffers are 
+    allocated for the selected rows only.
+
+    Returns
+    ----------
+    sources : list
+        same as _count_rows, number of rows are of selected rows
+
+    coords : list of numpy array
+        coordinates of selected rows for each of sources
+    """
+    if _is_manifest(tablelist) :
+        tablelist = [e["name"] for e in tablelist["files"] if not e["empty"]]
+    elif isinstance(tablelist, str) :
+        tablelist = _filenames(tablelist)
+
+    arglist = [(t, nodenames, wherenode, where, condvars) for t in tablelist]
+    if executor is not None and all([isinstance(t, str) for t in tablelist]) :
+        selections = _imap(executor, _select_file_rows, arglist, depth)
+    else :
+        selections = [_select_file_rows(*(args + (pool,))) for args in arglist]
+
+    sources = []
+    coords = []
+    for src, selected in zip(tablelist, selections) :
+        if selected is not None :
+            sources.append([src, dict([(n, len(selected)) for n in nodenames])])
+            coords.append(selected)
+    return sources, coords
+
+#--------------------------------------------------
+def _empty(shape, dtype, fname=None) :
+    """
+    np.empty, or if fname is given, a .npy file
+    preallocated with shape and dtype and opened as memmap
+    """
+    if fname is None :
+        return np.empty(shape, dtype=dtype)
+    # row counts may be numpy integers, which can't be written in .npy header
+    shape = tuple([int(n) for n in np.atleast_1d(shape)])
+    return np.lib.format.open_memmap(fname, mode="w+", dtype=dtype, shape=shape)
+
+#--------------------------------------------------
+def _allocate_leaves(node, leafnames, nrows, dtypes=None, outfiles=None) :
+    """
+    Allocate output buffers for leaves of the node.
+
+    Parameters
+    ----------
+    dtypes : dict
+        {leafname: dtype} to cast. leaves not in dtypes
+        keep their dtype on disk.
+
+    outfiles : dict
+        {leafname: .npy filename}. leaves in outfiles are
+        allocated as memmaps of the files.
+
+    Returns
+    ----------
+    outs : dict
+        {leafname: empty numpy array with nrows rows}
+    """
+    if dtypes is None :
+        dtypes = {}
+    if outfiles is None :
+        outfiles = {}
+    outs = {}
+    for leafname in leafnames :
+        coltype = node.coldtypes[leafname]
+        dtype = dtypes.get(leafname, coltype.base)
+        outs[leafname] = _empty((nrows,) + coltype.shape, dtype, outfiles.get(leafname))
+    return outs
+
+#--------------------------------------------------
+def _resolve_dtypes(dtype, paths) :
+    """
+    Make a casting map for leaves in paths.
+
+    Parameters
+    ----------
+    dtype : None or dtype or dict
+        None : no cast
+        dtype : cast all leaves to dtype
+        dict : {leafname: dtype} or {(nodename, leafname): dtype}
+               (nodename, leafname) has priority.
+
+    paths : dict
+        {nodename: [leafname, ...]}, nodename must start with "/"
+
+    Returns
+    ----------
+    dtypes : dict
+        {nodename: {leafname: numpy dtype}} for leaves to be cast
+    """
+    dtypes = dict([(n, {}) for n in paths])
+    if dtype is None :
+        return dtypes
+
+    casts = {}
+    if isinstance(dtype, dict) :
+        for key, value in dtype.items() :
+            if isinstance(key, tuple) :
+                key = (_nodepath(key[0]), key[1])
+            casts[key] = np.dtype(value)
+
+    for nodename, leafnames in paths.items() :
+        for leafname in leafnames :
+            if not isinstance(dtype, dict) :
+                dtypes[nodename][leafname] = np.dtype(dtype)
+            elif (nodename, leafname) in casts :
+                dtypes[nodename][leafname] = casts[(nodename, leafname)]
+            elif leafname in casts :
+                dtypes[nodename][leafname] = casts[leafname]
+    return dtypes
+
+#--------------------------------------------------
+def _resolve_outfiles(out_path, paths, dtypes) :
+    """
+    Make a map of output .npy files for leaves in paths.
+
+    Parameters
+    ----------
+    out_path : None or str or dict
+        None : no output file
+        str : directory, each leaf is written to
+              out_path/<node>.<leaf>.npy
+        dict : {(nodename, leafname): .npy filename}
+
+    paths : dict
+        {nodename: [leafname, ...]}, nodename must start with "/"
+
+    dtypes : dict
+        return value of _resolve_dtypes
+
+    Returns
+    ----------
+    outfiles : dict
+        {nodename: {leafname: .npy filename}}
+    """
+    outfiles = dict([(n, {}) for n in paths])
+    if out_path is None :
+        return outfiles
+
+    if isinstance(out_path, dict) :
+        for (nodename, leafname), fname in out_path.items() :
+            outfiles[_nodepath(nodename)][leafname] = fname
+        return outfiles
+
+    if not os.path.exists(out_path) :
+        os.makedirs(out_path)
+    for nodename, leafnames in paths.items() :
+        for leafname in leafnames :
+            colname = _column_name(nodename, leafname, dtypes[nodename].get(leafname))
+            outfiles[nodename][leafname] = os.path.join(out_path, colname + ".npy")
+    return outfiles
+
+#--------------------------------------------------
+def _read_file_columns(fname, leaves, coords=None, dtypes=None, counts=None) :
+    """
+    Read all requested leaves of one file.
+    counts is {nodename: nrows} counted in the first pass.
+
+    Returns
+    ----------
+    bufs : dict
+        {nodename: {leafname: numpy array}}
+    """
+    with TablePool() as pool :
+        myt = _handle(fname, pool)
+        bufs = {}
+        for nodename, leafnames in leaves.items() :
+            node = myt.get_node(nodename)
+            nrows = node.nrows if counts is None else counts[nodename]
+            if coords is not None :
+                nrows = len(coords)
+            bufs[nodename] = _allocate_leaves(node, leafnames, nrows, dtypes and dtypes[nodename])
+            _read_node(node, leafnames, bufs[nodename], 0, coords, nrows)
+    return bufs
+
+#--------------------------------------------------
+def _fill_columns(sources, leaves, executor=None, depth=1, coords=None, pool=None, dtypes=None, 
+                  outfiles=None) :
+    """
+    Second pass of the two-pass reader.
+    Allocate one output array per leaf and fill them 
+    in place file by file. Each file is opened once
+    and each node is read once.
+
+    Parameters
+    ----------
+    sources : list
+        return value of _count_rows
+
+    leaves : dict
+        {nodename: [leafname, ...]}, nodename must start with "/"
+
+    executor : concurrent.futures.Executor
+        if given, files are read in worker processes and
+        the slices are placed in the original file order.
+
+    depth : int
+        max number of tasks in flight for executor
+
+    coords : list of numpy array
+        return value of _select_rows, if given only
+        the selected rows are read
+
+    pool : TablePool
+        pool to open files
+
+    dtypes : dict
+        return value of _resolve_dtypes, leaves are cast
+        while filling the output buffers.
+
+    outfiles : dict
+        return value of _resolve_outfiles, leaves in outfiles
+        are filled into memmaps of the .npy files.
+
+    Returns
+    ----------
+    bufs : dict
+        {nodename: {leafname: (n, 1) numpy array or memmap}}
+
+    """
+    if dtypes is None :
+        dtypes = _resolve_dtypes(None, leaves)
+    if outfiles is None :
+        outfiles = _resolve_outfiles(None, leaves, dtypes)
+    bufs = dict([(n, {}) for n in leaves])
+    starts = dict([(n, 0) for n in leaves])
+    totals = dict([(n, sum([nrows[n] for src, nrows in sources])) for n in leaves])
+    if coords is None :
+        coords = [None] * len(sources)
+
+    if executor is None :
+        for (src, nrows), selected in zip(sources, coords) :
+            myt = _handle(src, pool)
+            for nodename, leafnames in leaves.items() :
+                node = myt.get_node(nodename)
+                if len(bufs[nodename]) == 0 :
+                    bufs[nodename] = _allocate_leaves(node, leafnames, totals[nodename], 
+                                                      dtypes[nodename], outfiles[nodename])
+                _read_node(node, leafnames, bufs[nodename], starts[nodename], selected, 
+                           nrows[nodename])
+                starts[nodename] += nrows[nodename]
+
+    else :
+        filenames = _filenames([src for src, nrows in sources])
+        arglist = [(f, leaves, c, dtypes, nrows) for f, c, (src, nrows) in zip(filenames, coords, sources)]
+        filebufs = _imap(executor, _read_file_columns, arglist, depth)
+        for (src, nrows), filebuf in zip(sources, filebufs) :
+            for nodename, leafnames in leaves.items() :
+                outs = bufs[nodename]
+                start = starts[nodename]
+                stop = start + nrows[nodename]
+                for leafname in leafnames :
+                    arr = filebuf[nodename][leafname]
+                    if not leafname in outs :
+                        outs[leafname] = _empty((totals[nodename],) + arr.shape[1:], arr.dtype,
+                                                outfiles[nodename].get(leafname))
+                    outs[leafname][start:stop] = arr
+                starts[nodename] = stop
+
+    for nodename, leafnames in leaves.items() :
+        for leafname in leafnames :
+            if not leafname in bufs[nodename] :
+                # no table is filled
+                bufs[nodename][leafname] = _empty(0, dtypes[nodename].get(leafname, float), 
+                                                  outfiles[nodename].get(leafname))
+            buf = bufs[nodename][leafname]
+            if isinstance(buf, np.memmap) :
+                buf.flush()
+    return bufs
+
+#--------------------------------------------------
+def _read_columns(tablelist, paths, workers=0, where=None, wherenode=None, condvars=None, pool=None, dtypes=None, 
+                  outfiles=None) :
+    """
+    Read leaves with the two-pass reader.
+    paths is {nodename: [leafname, ...]}, nodename must start with "/"
+    if where is given, only rows of wherenode selected by
+    where are read from every node.
+    Returns bufs and sources (see _count_rows, nrows are
+    numbers of selected rows if where is given).
+    """
+    executor = None
+    depth = 1
+    if workers > 1 :
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=workers)
+        depth = 2*workers
+
+    try :
+        nodenames = list(paths.keys())
+        coords = None
+        if where is None :
+            sources = _count_rows(tablelist, nodenames, executor, 2*depth, pool)
+        else :
+            sources, coords = _select_rows(tablelist, nodenames, wherenode, where, condvars, executor, 2*depth, pool)
+        bufs = _fill_columns(sources, paths, executor, depth, coords, pool, dtypes, outfiles)
+    finally :
+        if executor is not None :
+            executor.shutdown()
+    return bufs, sources
+
+#--------------------------------------------------
+def _column_name(nodename, leafname, dtype=None) :
+    """
+    file-system friendly name of a merged column
+    e.g. ("/I3MCWeightDict", "OneWeight") -> "I3MCWeightDict.OneWeight"
+    if dtype is given, it's added as ("/MCPrimary", "energy", "f4") -> "MCPrimary.energy@f4"
+    """
+    colname = "%s.%s" % (nodename.strip("/").replace("/", "."), leafname)
+    if dtype is not None :
+        colname += "@" + np.dtype(dtype).str.lstrip("<>|=")
+    return colname
+
+#--------------------------------------------------
+def _file_stats(filenames) :
+    """
+    list of [absolute path, size, mtime] of files.
+    used to detect modification of files.
+    """
+    stats = []
+    for fname in filenames :
+        st = os.stat(fname)
+        stats.append([os.path.abspath(fname), st.st_size, st.st_mtime])
+    return stats
+
+#--------------------------------------------------
+def _fingerprint(*items) :
+    """
+    sha1 hex digest of json-serializable items
+    """
+    return hashlib.sha1(json.dumps(items).encode("utf-8")).hexdigest()
+
+#--------------------------------------------------
+def _changed_files(files, stats) :
+    """
+    True if any of files ([path, size, mtime] recorded in a 
+    cache) is modified or removed. stats of the current
+    file list are used for files in it, others are stat-ed.
+    """
+    current = dict([(s[0], s) for s in stats])
+    for f in files :
+        stat = current.get(f[0])
+        if stat is None :
+            try :
+                st = os.stat(f[0])
+            except OSError :
+                return True
+            stat = [f[0], st.st_size, st.st_mtime]
+        if stat != f :
+            return True
+    return False
+
+#--------------------------------------------------
+def _find_cache(cachedir, colname, stats) :
+    """
+    Search the cached column whose file list matches
+    the head of stats the most. If a cached column records
+    the number of rows of each file, its head is used even
+    if later files differ, e.g. the cache of files A, B, C
+    gives rows of A, B for the list A, B or A, B, D.
+
+    Returns
+    ----------
+    nfiles : int
+        number of files of stats already merged in the cache
+
+    npyname : str or None
+        name of the cached .npy file, None if not found
+
+    meta : dict or None
+        json of npyname
+
+    stales : list of str
+        names of cached .npy files that have a modified or 
+        removed file, they should be removed. cached columns
+        of other file lists are kept.
+    """
+    nfiles = 0
+    npyname = None
+    found = None
+    exact = False
+    stales = []
+    for metaname in glob.glob(os.path.join(cachedir, colname + ".*.json")) :
+        with open(metaname) as f :
+            meta = json.load(f)
+        name = metaname[:-len(".json")] + ".npy"
+        if not os.path.exists(name) :
+            # renamed by an append that was interrupted
+            stales.append(name)
+            continue
+        files = meta["files"]
+        n = 0
+        while n < min(len(files), len(stats)) and files[n] == stats[n] :
+            n += 1
+        if n < len(files) and _changed_files(files[n:], stats) :
+            stales.append(name)
+            continue
+        if n < len(files) and not "counts" in meta :
+            continue
+        if npyname is None or n > nfiles or (n == nfiles and n == len(files) and not exact) :
+            nfiles = n
+            npyname = name
+            found = meta
+            exact = n == len(files)
+    return nfiles, npyname, found, stales
+
+#--------------------------------------------------
+def _open_cache(cachedir, colname, stats) :
+    """
+    _find_cache and remove stale cached columns.
+
+    Returns
+    ----------
+    buf : numpy memmap or None
+        cached column (read only) if all files of stats
+        are cached, otherwise None
+
+    nfiles : int
+        see _find_cache
+
+    old : tuple or None
+        (npyname, meta, memmap) of the cached column
+        to be extended, given to _write_cache. it's 
+        mapped here so that its rows can be read even if 
+        another job appends to it and renames it.
+
+    counts : list of int or None
+        number of rows of each of the first nfiles files,
+        None if the cache doesn't record them
+    """
+    nfiles, npyname, meta, stales = _find_cache(cachedir, colname, stats)
+    for stale in stales :
+        for name in [stale, stale[:-len(".npy")] + ".json"] :
+            try :
+                os.remove(name)
+            except OSError :
+                # removed by another job
+                pass
+    if npyname is None :
+        return None, 0, None, None
+    try :
+        buf = np.load(npyname, mmap_mode="r")
+    except FileNotFoundError :
+        # renamed by another job, rebuilt from scratch
+        return None, 0, None, None
+    counts = None
+    if "counts" in meta :
+        counts = meta["counts"][:nfiles]
+        buf = buf[:sum(counts)]
+    if nfiles == len(stats) :
+        return buf, nfiles, None, counts
+    return None, nfiles, (npyname, meta, buf), counts
+
+#--------------------------------------------------
+def _file_counts(filenames, sources, nodename) :
+    """
+    number of rows of nodename in each of filenames
+    taken from sources (return value of _count_rows),
+    0 for empty files
+    """
+    names = [os.path.abspath(f) for f in _filenames([src for src, nrows in sources])]
+    found = dict(zip(names, [nrows[nodename] for src, nrows in sources]))
+    return [int(found.get(os.path.abspath(f), 0)) for f in filenames]
+
+#--------------------------------------------------
+def _append_npy(npyname, nrows, newbuf) :
+    """
+    Append newbuf to a .npy file in place after its first 
+    nrows rows, and rewrite the shape in the header.
+    Only the new rows are written, rows after nrows are
+    overwritten.
+
+    Returns
+    ----------
+    done : bool
+        False if it can't be done in place (different dtype
+        or row shape, or no room for the new shape in the 
+        header), then the file is not changed.
+    """
+    import io
+    fmt = np.lib.format
+    with open(npyname, "r+b") as f :
+        version = fmt.read_magic(f)
+        if version == (1, 0) :
+            shape, fortran, dtype = fmt.read_array_header_1_0(f)
+        elif version == (2, 0) :
+            shape, fortran, dtype = fmt.read_array_header_2_0(f)
+        else :
+            return False
+        offset = f.tell()
+        if fortran or dtype.hasobject or dtype != newbuf.dtype or \
+           tuple(shape[1:]) != newbuf.shape[1:] or shape[0] < nrows :
+            return False
+
+        header = io.BytesIO()
+        d = {"descr" : fmt.dtype_to_descr(dtype), "fortran_order" : False, 
+             "shape" : (nrows + len(newbuf),) + tuple(shape[1:])}
+        if version == (1, 0) :
+            fmt.write_array_header_1_0(header, d)
+        else :
+            fmt.write_array_header_2_0(header, d)
+        header = header.getvalue()
+        if len(header) != offset :
+            return False
+
+        rowbytes = dtype.itemsize * int(np.prod(shape[1:], dtype=np.int64))
+        f.seek(offset + nrows*rowbytes)
+        np.ascontiguousarray(newbuf).tofile(f)
+        f.truncate()
+        f.flush()
+        # the new shape becomes visible only after all rows are written
+        f.seek(0)
+        f.write(header)
+    return True
+
+#--------------------------------------------------
+def _write_cache(cachedir, colname, nodename, leafname, stats, old, newbuf, extra=None, 
+                 counts=None) :
+    """
+    Write a cached column made of the old cached column
+    (old given by _open_cache, if exists) followed by newbuf,
+    and remove the old one. extra is a dict added to the json.
+    counts is the number of rows of each new file, recorded 
+    in the json with those of the old cached column.
+    If the old one is the head of the new one, newbuf is
+    appended to its .npy in place, so that only new rows
+    are written, and the .npy is renamed.
+    The old one is claimed (see _claim) while it's appended
+    and removed. If another job has claimed it, its rows
+    are copied to a new .npy and it's left to that job.
+
+    Returns
+    ----------
+    buf : numpy memmap of the new cached column (read only)
+    """
+    base = os.path.join(cachedir, "%s.%s" % (colname, _fingerprint(colname, stats)))
+
+    oldnpy = None
+    oldmeta = {"counts" : []}
+    oldbuf = newbuf[:0]
+    if old is not None :
+        oldnpy, oldmeta, oldbuf = old
+    nfiles = len(stats) - (len(counts) if counts is not None else 0)
+    if counts is not None and "counts" in oldmeta and len(oldmeta["counts"]) >= nfiles :
+        counts = oldmeta["counts"][:nfiles] + list(counts)
+        # only the head of the old one may be used
+        oldbuf = oldbuf[:sum(counts[:nfiles])]
+    else :
+        counts = None
+    nold = len(oldbuf)
+    total = nold + len(newbuf)
+    # the old one is the head of the new one, a longer one is kept
+    replaced = oldnpy is not None and oldnpy != base + ".npy" and len(oldmeta["files"]) == nfiles
+    # only one job may append to the old one and remove it
+    claimed = replaced and _claim(oldnpy + ".claim")
+    try :
+        if claimed and counts is not None and os.path.exists(oldnpy) and \
+           (len(newbuf) == 0 or _append_npy(oldnpy, nold, newbuf)) :
+            os.rename(oldnpy, base + ".npy")
+        else :
+            # empty column of a file list without any table is float zeros(0),
+            # so take dtype and shape from the non-empty one
+            like = newbuf
+            if nold > 0 :
+                like = oldbuf
+
+            # other jobs may build the same file list at the same time
+            tmpname = "%s.npy.%d.tmp" % (base, os.getpid())
+            out = np.lib.format.open_memmap(tmpname, mode="w+", dtype=like.dtype, 
+                                            shape=(total,) + like.shape[1:])
+            if nold > 0 :
+                out[:nold] = oldbuf
+            if len(newbuf) > 0 :
+                out[nold:] = newbuf
+            out.flush()
+            del out
+            os.rename(tmpname, base + ".npy")
+        del oldbuf
+
+        meta = {"node" : nodename, "leaf" : leafname, "nrows" : total, "files" : stats}
+        if counts is not None :
+            meta["counts"] = counts
+        if extra is not None :
+            meta.update(extra)
+        tmpname = "%s.json.%d.tmp" % (base, os.getpid())
+        with open(tmpname, "w") as f :
+            json.dump(meta, f)
+        os.rename(tmpname, base + ".json")
+
+        if claimed :
+            for name in [oldnpy, oldnpy[:-len(".npy")] + ".json"] :
+                try :
+                    os.remove(name)
+                except OSError :
+                    # renamed above, or removed as stale by another job
+                    pass
+    finally :
+        if claimed :
+            os.remove(oldnpy + ".claim")
+
+    return np.load(base + ".npy", mmap_mode="r")
+
+#--------------------------------------------------
+def _read_cached_columns(tablelist, paths, cachedir, workers=0, pool=None, dtypes=None, stats=None) :
+    """
+    Column cache layer of read_tables_multi.
+    Each merged column is stored in cachedir as .npy with 
+    a .json that records the list of merged files with their
+    size and mtime. If the file list and stats match, the 
+    cached column is memory-mapped. If files are only added
+    at the end of the list, only the new files are read and
+    appended. Otherwise the column is rebuilt.
+    Columns cast to other dtype are cached separately.
+    stats is the return value of _file_stats of tablelist,
+    files are stat-ed if None.
+
+    Returns
+    ----------
+    bufs : dict
+        {nodename: {leafname: read-only memmap}}
+
+    sources : list or None
+        same as _count_rows, made from numbers of rows of 
+        each file recorded in the cache. None if a cached
+        column doesn't record them.
+    """
+    if dtypes is None :
+        dtypes = _resolve_dtypes(None, paths)
+    if isinstance(tablelist, str) :
+        tablelist = _filenames(tablelist)
+    filenames = _filenames(tablelist)
+    if stats is None :
+        stats = _file_stats(filenames)
+    if _is_manifest(tablelist) :
+        tablelist = tablelist["files"]
+    if not os.path.exists(cachedir) :
+        os.makedirs(cachedir)
+
+    bufs = dict([(n, {}) for n in paths])
+    filecounts = dict([(n, {}) for n in paths]) # {nodename: {leafname: counts or None}}
+    olds = {}
+    groups = {} # {nfiles already cached : {nodename: [leafname, ...]}}
+    for nodename, leafnames in paths.items() :
+        for leafname in leafnames :
+            colname = _column_name(nodename, leafname, dtypes[nodename].get(leafname))
+            buf, nfiles, old, counts = _open_cache(cachedir, colname, stats)
+            filecounts[nodename][leafname] = counts
+            if buf is not None :
+                bufs[nodename][leafname] = buf
+                continue
+            if nfiles == 0 :
+                filecounts[nodename][leafname] = []
+            olds[(nodename, leafname)] = old
+            groups.setdefault(nfiles, {}).setdefault(nodename, []).append(leafname)
+
+    for nfiles, leaves in groups.items() :
+        newlist = tablelist[nfiles:]
+        if len(newlist) > 0 and isinstance(newlist[0], dict) :
+            # manifest entries
+            newlist = {"files" : newlist}
+        newbufs, sources = _read_columns(newlist, leaves, workers, pool=pool, dtypes=dtypes)
+        newfiles = [s[0] for s in stats[nfiles:]]
+        for nodename, leafnames in leaves.items() :
+            counts = _file_counts(newfiles, sources, nodename)
+            for leafname in leafnames :
+                colname = _column_name(nodename, leafname, dtypes[nodename].get(leafname))
+                bufs[nodename][leafname] = _write_cache(cachedir, colname, nodename, leafname, stats, 
+                                 olds[(nodename, leafname)], newbufs[nodename][leafname],
+                                 counts=counts)
+                if filecounts[nodename][leafname] is not None :
+                    filecounts[nodename][leafname] = filecounts[nodename][leafname] + counts
+
+    # number of rows of each node in each file, empty files are skipped as _count_rows does
+    nodecounts = {}
+    for nodename, leafnames in paths.items() :
+        nodecounts[nodename] = filecounts[nodename][leafnames[0]]
+        if any([filecounts[nodename][l] is None for l in leafnames]) :
+            return bufs, None
+    sources = []
+    for i, (fname, stat) in enumerate(zip(filenames, stats)) :
+        if stat[1] >= EMPTY_FILESIZE :
+            sources.append([fname, dict([(n, nodecounts[n][i]) for n in paths])])
+    return bufs, sources
+
+#--------------------------------------------------
+class Provenance() :
+    """
+    Files of rows of a merged column, stored as run-length
+    segments: rows offsets[i]:offsets[i+1] come from files[i].
+    Memory is proportional to number of files, and full-length
+    arrays are made only by broadcast and file_ids.
+
+    Usage:
+        buf, prov = read_tables(files, "I3MCWeightDict", "OneWeight", provenance=True)
+        nfiles = {"11029" : 3190, "11069" : 3920}
+        dataset = [os.path.basename(f).split(".")[3] for f in prov.files]
+        weights = buf / prov.broadcast([nfiles[d] for d in dataset])
+    """
+    def __init__(self, files, counts) :
+        self.files = list(files)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(self.counts)]).astype(np.int64)
+
+    @classmethod
+    def from_sources(cls, sources, nodename) :
+        """
+        make Provenance from return value of _count_rows
+        """
+        files = _filenames([src for src, nrows in sources])
+        return cls(files, [nrows[nodename] for src, nrows in sources])
+
+    def __len__(self) :
+        return int(self.offsets[-1])
+
+    def __repr__(self) :
+        return "Provenance(%d rows from %d files)" % (len(self), len(self.files))
+
+    def segments(self) :
+        """
+        iterate (filename, start, stop) of each file
+        """
+        for i, fname in enumerate(self.files) :
+            yield fname, int(self.offsets[i]), int(self.offsets[i+1])
+
+    def file_of(self, rows) :
+        """
+        file indices of rows
+        """
+        return np.searchsorted(self.offsets, rows, side="right") - 1
+
+    def broadcast(self, values) :
+        """
+        Broadcast per-file values onto rows.
+
+        Parameters
+        ----------
+        values : array like or dict
+            one value (or row of values) per file in order of
+            files, or {filename: value}
+
+        Returns
+        ----------
+        buf : numpy array of len(self) rows
+        """
+        if isinstance(values, dict) :
+            values = [values[f] for f in self.files]
+        values = np.asarray(values)
+        if len(values) != len(self.files) :
+            raise ValueError("%d values are given for %d files" % (len(values), len(self.files)))
+        return np.repeat(values, self.counts, axis=0)
+
+    def file_ids(self) :
+        """
+        file index of every row, same as broadcast(arange(nfiles))
+        """
+        return self.broadcast(np.arange(len(self.files), dtype=np.int32))
+
+    def apply(self, buf, values, ufunc=np.multiply) :
+        """
+        ufunc(buf[segment], value of the file) for each file
+        in place, without a full-length array of values.
+        e.g. prov.apply(weights, 1./nfiles, np.multiply)
+        """
+        if isinstance(values, dict) :
+            values = [values[f] for f in self.files]
+        for i, (fname, start, stop) in enumerate(self.segments()) :
+            ufunc(buf[start:stop], values[i], out=buf[start:stop])
+        return buf
+
+#--------------------------------------------------
+class DerivedColumn() :
+    """
+    Column computed from leaves of one node with a numexpr
+    expression, e.g. "log10(energy)". Use define_column to 
+    make and register it, and read_derived to compute it.
+    """
+    def __init__(self, name, expression, nodename, leafnames=None) :
+        self.name = name
+        self.expression = expression
+        self.nodename = _nodepath(nodename)
+        if leafnames is None :
+            # names in the expression that are not functions
+            import numexpr.expressions
+            names = compile(expression, "<%s>" % name, "eval").co_names
+            leafnames = [n for n in names if not n in numexpr.expressions.functions]
+        self.leafnames = list(leafnames)
+
+    def __repr__(self) :
+        return "DerivedColumn(%s = %s on %s)" % (self.name, self.expression, self.nodename)
+
+    @property
+    def colname(self) :
+        """
+        name in the column cache, changes with the expression
+        """
+        return "%s.%s" % (self.name, _fingerprint(self.nodename, self.expression, self.leafnames)[:12])
+
+    def evaluate(self, tablelist, chunk_rows=READ_CHUNK_ROWS, pool=None) :
+        """
+        compute the column chunk by chunk, so temporaries 
+        are at most chunk_rows long
+        """
+        return self._evaluate(tablelist, chunk_rows, pool)[0]
+
+    def _evaluate(self, tablelist, chunk_rows=READ_CHUNK_ROWS, pool=None) :
+        """
+        evaluate and return (buf, sources), sources 
+        is the return value of _count_rows
+        """
+        import numexpr
+        with _scoped_pool(pool) as pool :
+            sources = _count_rows(tablelist, [self.nodename], pool=pool)
+            total = sum([nrows[self.nodename] for src, nrows in sources])
+            buf = None
+            for offset, chunk in iter_chunks(tablelist, self.nodename, self.leafnames, chunk_rows, pool=pool) :
+                values = numexpr.evaluate(self.expression, local_dict=chunk)
+                if buf is None :
+                    buf = np.empty((total,) + values.shape[1:], dtype=values.dtype)
+                buf[offset:offset + len(values)] = values
+        if buf is None :
+            buf = np.zeros(0)
+        return buf, sources
+
+_derived_columns = {}
+
+#--------------------------------------------------
+def define_column(name, expression, nodename, leafnames=None) :
+    """
+    Declare a derived column once, then read it with 
+    read_derived by name.
+
+    Parameters
+    ----------
+    name : str
+        name of the column, e.g. "logE"
+
+    expression : str
+        numexpr expression of leaves of nodename, e.g.
+        "log10(energy)", "cos(zenith)", "OneWeight / NEvents"
+
+    nodename : str
+        node that has the leaves
+
+    leafnames : list of str
+        leaves used in expression. if None, all names in
+        expression except numexpr functions.
+
+    Returns
+    ----------
+    column : DerivedColumn
+    """
+    column = DerivedColumn(name, expression, nodename, leafnames)
+    _derived_columns[name] = column
+    return column
+
+#--------------------------------------------------
+def read_derived(tablelist, name, cachedir=None, chunk_rows=READ_CHUNK_ROWS, pool=None) :
+    """
+    Compute the derived column registered with define_column.
+
+    Parameters
+    ----------
+    tablelist : str or list of tables or list of str or dict
+        same as read_tables
+
+    name : str or DerivedColumn
+        name given to define_column
+
+    cachedir : str
+        if given, the column is stored in the column cache
+        with the expression and the list of files with their
+        size and mtime, and later calls load it as a memmap.
+        If files are only added at the end of the list, only
+        rows of the new files are computed and appended.
+        Changing the expression makes a new cache entry.
+
+    chunk_rows : int
+        max number of rows evaluated at once
+
+    pool : TablePool
+        pool to open files. if None, files are closed
+        before returning.
+
+    Returns
+    ----------
+    buf : (n, 1) numpy array or read-only memmap
+    """
+    column = name
+    if not isinstance(column, DerivedColumn) :
+        column = _derived_columns[name]
+    if cachedir is None :
+        return column.evaluate(tablelist, chunk_rows, pool)
+
+    if isinstance(tablelist, str) :
+        tablelist = _filenames(tablelist)
+    stats = _file_stats(_filenames(tablelist))
+    if _is_manifest(tablelist) :
+        tablelist = tablelist["files"]
+    if not os.path.exists(cachedir) :
+        os.makedirs(cachedir)
+
+    buf, nfiles, old, counts = _open_cache(cachedir, column.colname, stats)
+    if buf is not None :
+        return buf
+
+    newlist = tablelist[nfiles:]
+    if len(newlist) > 0 and isinstance(newlist[0], dict) :
+        # manifest entries
+        newlist = {"files" : newlist}
+    newbuf, sources = column._evaluate(newlist, chunk_rows, pool)
+    extra = {"expression" : column.expression, "leaves" : column.leafnames}
+    counts = _file_counts([s[0] for s in stats[nfiles:]], sources, column.nodename)
+    return _write_cache(cachedir, column.colname, column.nodename, column.name, stats, 
+                        old, newbuf, extra, counts)
+
+#--------------------------------------------------
+def read_tables_multi(tablelist, leaves, workers=0, cachedir=None, where=None, wherenode=None, condvars=None, 
+                      pool=None, dtype=None, out_path=None, provenance=False) :
+    """
+    Read multiple leaves of multiple nodes from tables
+    and merge them to (n, 1) arrays.
+    Each file is opened once and rows of each node are
+    read once, so it is much faster than calling 
+    read_tables for each leaf.
+
+    Parameters
+    ----------
+    tablelist : str or list of tables or list of str
+        filename of list of h5 files or 
+        filename that contains wildcard or
+        list of opened h5 objects stored with load_tables or
+        list of h5 filenames
+
+    leaves : dict
+        {nodename: [leafname, ...]}
+        e.g. {"I3MCWeightDict": ["OneWeight", "NEvents"],
+              "MCPrimary": ["energy", "zenith"]}
+
+    workers : int
+        if larger than 1, files are read by this number of 
+        worker processes and the parent places the slices 
+        in the original file order. The output is identical
+        to the serial read. If tablelist is list of tables,
+        the workers reopen the files by their filenames.
+
+    cachedir : str
+        if given, merged columns are cached in this directory
+        as .npy files keyed by the file list and size and 
+        mtime of each file, and returned as read-only memmaps.
+        The cache is invalidated if any file is modified,
+        and if files are only added at the end of the list,
+        only the new files are read and appended.
+
+    where : str
+        selection evaluated in each file with PyTables 
+        in-kernel query, e.g. "(zenith > 1.57) & (log10(energy) > 5)".
+        Variables are leaves of wherenode. Requested leaves
+        are read only at the selected rows, so memory and I/O
+        scale with the selected events. All requested nodes 
+        must have same number of rows as wherenode.
+        Can't be used with cachedir.
+
+    wherenode : str
+        node on which where is evaluated. if only one node
+        is requested, it's used by default.
+
+    condvars : dict
+        extra variables used in where, e.g. {"emin" : 1e5}
+
+    pool : TablePool
+        pool to open files. if None, files are opened in a
+        temporary pool and closed before returning. Give a 
+        pool (e.g. get_pool()) to keep at most MAX_OPEN_FILES
+        files open, so that repeated reads of the same files
+        hit warm handles.
+
+    dtype : dtype or dict
+        cast leaves while filling the output buffers, so that
+        no full-size copy in the on-disk dtype is made.
+        dtype : all leaves are cast to dtype
+        dict : {leafname: dtype} or {(nodename, leafname): dtype}
+        e.g. {"energy" : np.float32, ("MCPrimary", "pdg") : np.int16}
+
+    out_path : str or dict
+        if given, merged columns are written straight into 
+        preallocated .npy files and returned as memmaps, so
+        columns larger than memory can be merged.
+        str : directory, files are named <node>.<leaf>.npy
+        dict : {(nodename, leafname): .npy filename}
+        Can't be used with cachedir.
+
+    provenance : bool
+        if True, Provenance of each node is returned too,
+        which tells the file of each row, see Provenance.
+
+    Returns
+    ----------
+    bufs : dict
+        {nodename: {leafname: (n, 1) numpy array}}
+        keys are same as the given leaves.
+
+    provs : dict
+        {nodename: Provenance}, only if provenance is True
+
+    """
+    paths = {}
+    for nodename, leafnames in leaves.items() :
+        leaflist = paths.setdefault(_nodepath(nodename), [])
+        for leafname in leafnames :
+            if not leafname in leaflist :
+                leaflist.append(leafname)
+
+    dtypes = _resolve_dtypes(dtype, paths)
+
+    if out_path is not None and cachedir is not None :
+        raise ValueError("out_path can't be used with cachedir")
+    outfiles = _resolve_outfiles(out_path, paths, dtypes)
+
+    if where is not None :
+        if cachedir is not None :
+            raise ValueError("where can't be used with cachedir")
+        if wherenode is None :
+            if len(paths) != 1 :
+                raise ValueError("wherenode must be given to read multiple nodes with where")
+            wherenode = list(paths.keys())[0]
+        wherenode = _nodepath(wherenode)
+
+    with _scoped_pool(pool) as pool :
+        if cachedir is not None :
+            bufs, sources = _read_cached_columns(tablelist, paths, cachedir, workers, pool, dtypes)
+        else :
+            bufs, sources = _read_columns(tablelist, paths, workers, where, wherenode, condvars, pool, dtypes, outfiles)
+
+        results = {}
+        for nodename, leafnames in leaves.items() :
+            path = _nodepath(nodename)
+            results[nodename] = dict([(l, bufs[path][l]) for l in leafnames])
+        if not provenance :
+            return results
+
+        if sources is None :
+            # the cache doesn't record numbers of rows of files
+            sources = _count_rows(tablelist, list(paths.keys()), pool=pool)
+    provs = dict([(n, Provenance.from_sources(sources, _nodepath(n))) for n in leaves])
+    return results, provs
+
+#--------------------------------------------------
+def read_tables(tablelist, nodename, leafname, workers=0, cachedir=None, where=None, condvars=None, 
+                pool=None, dtype=None, out_path=None, provenance=False) :
+    """
+    Read data named leafname from tables and merge 
+    them to one (n, 1) array
+    Row counts are collected from all tables first,
+    then one output array is allocated and filled in place.
+    If tablelist is string, it opens only one table 
+    at a time.
+    To read many leaves, use read_tables_multi.
+
+    Parameters
+    ----------
+    tablelist : str or list of tables or list of str
+        filename of list of h5 files or 
+        filename that contains wildcard or
+        list of opened h5 objects stored with load_tables or
+        list of h5 filenames
+
+    nodename : str
+        name of branch of h5 file
+
+    leafname : str
+        name of leaf of h5 file
+
+    workers : int
+        number of worker processes, see read_tables_multi
+
+    cachedir : str
+        directory of the column cache, see read_tables_multi
+
+    where : str
+        selection on leaves of nodename, see read_tables_multi
+        e.g. read_tables(files, "MCPrimary", "energy", where="zenith > 1.57")
+
+    condvars : dict
+        extra variables used in where
+
+    pool : TablePool
+        pool to open files, see read_tables_multi
+
+    dtype : dtype
+        if given, the leaf is cast to dtype while filling
+        the output buffer, e.g. np.float32
+
+    out_path : str
+        if given, the merged column is written straight into
+        this .npy file and returned as memmap
+
+    provenance : bool
+        if True, (buf, Provenance) is returned, e.g.
+        buf, prov = read_tables(files, "I3MCWeightDict", "OneWeight", provenance=True)
+        weights = buf / prov.broadcast(nfiles_of_dataset)
+
+    Returns
+    ----------
+    buf : (n, 1) numpy array
+
+    """
+    if out_path is not None :
+        out_path = {(nodename, leafname) : out_path}
+
+    bufs = read_tables_multi(tablelist, {nodename: [leafname]}, workers=workers, cachedir=cachedir,
+                             where=where, condvars=condvars, pool=pool, dtype=dtype, out_path=out_path,
+                             provenance=provenance)
+    if provenance :
+        bufs, provs = bufs
+        return bufs[nodename][leafname], provs[nodename]
+    buf = bufs[nodename][leafname]
+
+    #print nodename, leafname, buf.shape
+    return buf
+
+#--------------------------------------------------
+def _table_nodenames(tablelist, pool=None) :
+    """
+    names of all table nodes in the first non-empty file
+    """
+    if _is_manifest(tablelist) :
+        for entry in tablelist["files"] :
+            if not entry["empty"] :
+                return sorted(entry["nodes"].keys())
+        return []
+
+    with _scoped_pool(pool) as pool :
+        for src in _filenames(tablelist) :
+            myt = _handle(src, pool)
+            if myt.get_filesize() >= EMPTY_FILESIZE :
+                return [node._v_pathname for node in myt.walk_nodes("/", "Table")]
+    return []
+
+#--------------------------------------------------
+def merge_files(tablelist, outname, nodenames=None, chunk_rows=READ_CHUNK_ROWS, 
+                complib="blosc", complevel=5, chunkshape=None, pool=None, errors=None) :
+    """
+    Merge nodes of many h5 files into one h5 file.
+    Rows are streamed from input files in bounded chunks,
+    so memory usage does not depend on number of files.
+    Later analyses can open the merged file instead of
+    paying per-file open and metadata costs.
+
+    Parameters
+    ----------
+    tablelist : str or list of tables or list of str or dict
+        same as read_tables
+
+    outname : str
+        name of output h5 file. It's written to outname.tmp
+        and renamed when finished.
+
+    nodenames : list of str
+        nodes to merge. if None, all table nodes in the first
+        non-empty file are merged.
+
+    chunk_rows : int
+        max number of rows read and written at once
+
+    complib : str
+        compression library, e.g. "blosc", "blosc:lz4", "zlib"
+
+    complevel : int
+        compression level (0 : no compression)
+
+    chunkshape : int or None
+        number of rows of HDF5 chunks of output tables.
+        if None, PyTables chooses it from total number of rows.
+
+    pool : TablePool
+        pool to open input files. if None, input files 
+        are closed before returning.
+
+    errors : dict
+        if given, a file that fails while it's read is 
+        skipped (its rows already written are removed) and
+        recorded as {fname: error message}. 
+        if None, the error is raised.
+
+    Returns
+    ----------
+    nrows : dict
+        {nodename: number of merged rows}
+
+    """
+    with _scoped_pool(pool) as pool :
+        if nodenames is None :
+            nodenames = _table_nodenames(tablelist, pool)
+        nodenames = [_nodepath(n) for n in nodenames]
+
+        sources = _count_rows(tablelist, nodenames, pool=pool)
+        totals = dict([(n, sum([nrows[n] for src, nrows in sources])) for n in nodenames])
+        filters = tables.Filters(complevel=complevel, complib=complib, shuffle=True)
+
+        outfile = tables.open_file(outname + ".tmp", mode="w")
+        outnodes = {}
+        nskipped = 0
+        try :
+            for ifile, (src, nrows) in enumerate(sources) :
+                starts = dict([(n, outnodes[n].nrows) for n in outnodes])
+                try :
+                    myt = _handle(src, pool)
+                    for nodename in nodenames :
+                        node = myt.get_node(nodename)
+                        if not nodename in outnodes :
+                            where, name = nodename.rsplit("/", 1)
+                            outnodes[nodename] = outfile.create_table(where or "/", name, 
+                                             description=node.description, title=node.title,
+                                             filters=filters, expectedrows=max(totals[nodename], 1),
+                                             chunkshape=chunkshape, createparents=True)
+                            node.attrs._f_copy(outnodes[nodename])
+                        outnode = outnodes[nodename]
+                        for first in range(0, node.nrows, chunk_rows) :
+                            outnode.append(node.read(first, min(first + chunk_rows, node.nrows)))
+                except Exception as e :
+                    if errors is None :
+                        raise
+                    fname = _filenames([src])[0]
+                    errors[fname] = _error_message(e)
+                    print("merge_files: %s is skipped (%s)" % (fname, errors[fname]))
+                    # remove rows of the file already written
+                    for nodename, outnode in outnodes.items() :
+                        outnode.truncate(starts.get(nodename, 0))
+                    pool.release(fname)
+                    nskipped += 1
+                outfile.flush()
+                if (ifile + 1) % 1000 == 0 :
+                    print("merge_files: %d/%d files merged" % (ifile + 1, len(sources)))
+            if nskipped > 0 :
+                totals = dict([(n, outnodes[n].nrows if n in outnodes else 0) for n in nodenames])
+        finally :
+            outfile.close()
+    os.rename(outname + ".tmp", outname)
+
+    print("merge_files: %d files are merged to %s" % (len(sources) - nskipped, outname))
+    return totals
+
+#--------------------------------------------------
+def _error_message(e) :
+    """
+    one line message of an exception. HDF5 errors come 
+    with the whole back trace, only the last line is kept.
+    """
+    lines = str(e).strip().splitlines()
+    return "%s: %s" % (type(e).__name__, lines[-1] if len(lines) > 0 else "")
+
+#--------------------------------------------------
+def _claim(claimname, timeout=CLAIM_TIMEOUT) :
+    """
+    Create claimname exclusively, so that only one of jobs
+    sharing a directory works on a shard or a cached 
+    column. A claim left by
+    a dead process on this host, or older than timeout
+    seconds, is taken over.
+
+    Returns
+    ----------
+    claimed : bool
+    """
+    for attempt in range(2) :
+        try :
+            fd = os.open(claimname, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError :
+            if attempt > 0 or not _stale_claim(claimname, timeout) :
+                return False
+            try :
+                os.remove(claimname)
+            except OSError :
+                pass
+            continue
+        with os.fdopen(fd, "w") as f :
+            json.dump({"host" : socket.gethostname(), "pid" : os.getpid(), "time" : time.time()}, f)
+        return True
+    return False
+
+#--------------------------------------------------
+def _stale_claim(claimname, timeout) :
+    """
+    True if the claim is older than timeout seconds or 
+    its process on this host is not running
+    """
+    try :
+        if time.time() - os.path.getmtime(claimname) > timeout :
+            return True
+        with open(claimname) as f :
+            owner = json.load(f)
+    except (OSError, ValueError) :
+        # removed or being written
+        return False
+    if owner.get("host") != socket.gethostname() :
+        return False
+    try :
+        os.kill(owner["pid"], 0)
+    except ProcessLookupError :
+        return True
+    except OSError :
+        pass
+    return False
+
+#--------------------------------------------------
+def _shard_name(workdir, ishard, ext) :
+    """
+    e.g. (workdir, 3, ".h5") -> workdir/shard_00003.h5
+    """
+    return os.path.join(workdir, "shard_%05d%s" % (ishard, ext))
+
+#--------------------------------------------------
+def plan_shards(tablelist, workdir, files_per_shard=500, nodenames=None) :
+    """
+    Split files into shards and save the plan as 
+    workdir/shards.json. If the plan already exists, it's
+    loaded and returned as is, so reruns and jobs on other
+    batch nodes see the same shards.
+
+    Parameters
+    ----------
+    tablelist : str or list of str or dict
+        same as read_tables. files are sorted by name.
+
+    workdir : str
+        directory of the plan, shard outputs and quarantine lists
+
+    files_per_shard : int
+        number of files in one shard
+
+    nodenames : list of str
+        nodes to merge. if None, all table nodes in the first
+        readable non-empty file are merged.
+
+    Returns
+    ----------
+    plan : dict
+        {"files" : [fname, ...], "nodes" : [nodename, ...],
+         "shards" : [[first, last], ...]}
+        shard i merges files[first:last]
+    """
+    planname = os.path.join(workdir, "shards.json")
+    if os.path.exists(planname) :
+        return load_manifest(planname)
+    if not os.path.exists(workdir) :
+        os.makedirs(workdir)
+
+    filenames = sorted(_filenames(tablelist))
+    if nodenames is None :
+        nodenames = []
+        for fname in filenames :
+            try :
+                nodenames = _table_nodenames([fname])
+            except Exception as e :
+                print("plan_shards: can't read %s (%s)" % (fname, e))
+                continue
+            if len(nodenames) > 0 :
+                break
+
+    files_per_shard = max(int(files_per_shard), 1)
+    shards = [[first, min(first + files_per_shard, len(filenames))] 
+              for first in range(0, len(filenames), files_per_shard)]
+    plan = {"files" : filenames, "nodes" : [_nodepath(n) for n in nodenames], "shards" : shards}
+
+    # plan may be written by jobs on other nodes at the same time
+    tmpname = "%s.%d.tmp" % (planname, os.getpid())
+    with open(tmpname, "w") as f :
+        json.dump(plan, f)
+    os.rename(tmpname, planname)
+    return load_manifest(planname)
+
+#--------------------------------------------------
+def quarantined_files(workdir) :
+    """
+    Collect unreadable files recorded by merge_shard.
+
+    Returns
+    ----------
+    quarantine : dict
+        {fname: error message}
+    """
+    quarantine = {}
+    for qname in sorted(glob.glob(os.path.join(workdir, "shard_*.quarantine"))) :
+        with open(qname) as f :
+            quarantine.update(json.load(f))
+    return quarantine
+
+#--------------------------------------------------
+def merge_shard(workdir, ishard, pool=None, **kwargs) :
+    """
+    Merge one shard of the plan made by plan_shards.
+    Files that can't be opened, don't have the nodes or
+    fail while they are merged are recorded in 
+    workdir/shard_N.quarantine and skipped, also in later 
+    runs. Good files are merged to workdir/shard_N.h5
+    with merge_files, then workdir/shard_N.json is written
+    as the checkpoint. A shard with the checkpoint is skipped.
+    While a job merges the shard, it holds the claim 
+    workdir/shard_N.claim and other jobs skip the shard.
+
+    Parameters
+    ----------
+    workdir : str
+        directory given to plan_shards
+
+    ishard : int
+        index of the shard
+
+    pool : TablePool
+        pool to open input files. if None, input files 
+        are closed before returning.
+
+    kwargs :
+        chunk_rows, complib, complevel and chunkshape
+        passed to merge_files
+
+    Returns
+    ----------
+    done : dict or None
+        content of the checkpoint
+        {"files" : number of merged files, "quarantined" : 
+         number of quarantined files, "nrows" : {nodename: nrows}}
+        None if another job is merging the shard.
+    """
+    donename = _shard_name(workdir, ishard, ".json")
+    if os.path.exists(donename) :
+        return load_manifest(donename)
+
+    claimname = _shard_name(workdir, ishard, ".claim")
+    if not _claim(claimname) :
+        print("merge_shard: shard %d is claimed by another job, skipped" % (ishard))
+        return None
+    try :
+        if os.path.exists(donename) :
+            # finished by another job
+            return load_manifest(donename)
+        return _merge_claimed_shard(workdir, ishard, pool, **kwargs)
+    finally :
+        os.remove(claimname)
+
+#--------------------------------------------------
+def _merge_claimed_shard(workdir, ishard, pool=None, **kwargs) :
+    """
+    body of merge_shard, called while holding the claim
+    """
+    donename = _shard_name(workdir, ishard, ".json")
+    plan = load_manifest(os.path.join(workdir, "shards.json"))
+    first, last = plan["shards"][ishard]
+    nodenames = plan["nodes"]
+    quarantine = quarantined_files(workdir)
+    with _scoped_pool(pool) as pool :
+        goodfiles, badfiles = _check_shard_files(plan["files"][first:last], nodenames, 
+                                                 quarantine, pool)
+        if len(badfiles) > 0 :
+            save_manifest(badfiles, _shard_name(workdir, ishard, ".quarantine"))
+
+        nrows = {}
+        if len(goodfiles) > 0 :
+            errors = {}
+            totals = merge_files(goodfiles, _shard_name(workdir, ishard, ".h5"), nodenames, 
+                                 pool=pool, errors=errors, **kwargs)
+            nrows = dict([(n, int(totals[n])) for n in totals])
+            if len(errors) > 0 :
+                for fname, message in errors.items() :
+                    print("merge_shard: quarantine %s (%s)" % (fname, message))
+                goodfiles = [f for f in goodfiles if not f in errors]
+                badfiles.update(errors)
+                save_manifest(badfiles, _shard_name(workdir, ishard, ".quarantine"))
+    done = {"files" : len(goodfiles), "quarantined" : len(badfiles), "nrows" : nrows}
+    save_manifest(done, donename)
+    return done
+
+#--------------------------------------------------
+def _check_shard_files(filenames, nodenames, quarantine, pool) :
+    """
+    open files of a shard and split them into good files 
+    and {filename: error message} of bad files
+    """
+    goodfiles = []
+    badfiles = {}
+    for fname in filenames :
+        if fname in quarantine :
+            badfiles[fname] = quarantine[fname]
+            continue
+        try :
+            _count_file_rows(fname, nodenames, pool)
+        except Exception as e :
+            message = _error_message(e)
+            print("merge_shard: quarantine %s (%s)" % (fname, message))
+            pool.release(fname)
+            badfiles[fname] = message
+            continue
+        goodfiles.append(fname)
+    return goodfiles, badfiles
+
+#--------------------------------------------------
+def _merge_shard_job(workdir, ishard, kwargs) :
+    """
+    merge_shard for worker processes, errors are returned
+    instead of raised so that other shards go on.
+    """
+    try :
+        return merge_shard(workdir, ishard, **kwargs)
+    except Exception as e :
+        return "%s: %s" % (type(e).__name__, e)
+
+#--------------------------------------------------
+def merge_sharded(tablelist, workdir, outname=None, files_per_shard=500, nodenames=None, 
+                  shards=None, workers=0, **kwargs) :
+    """
+    Resumable merge of many h5 files.
+    Files are split into shards (see plan_shards), each shard
+    is merged to its own h5 file (see merge_shard), and if all
+    shards are done and outname is given, shard outputs are 
+    merged to outname. Reruns with the same workdir only 
+    merge missing shards and skip quarantined files.
+    Jobs on batch nodes can share one workdir and merge
+    different shards, e.g. with shards=[i].
+
+    Parameters
+    ----------
+    tablelist : str or list of str or dict
+        same as read_tables, only used to make a new plan
+
+    workdir : str
+        directory of the plan and shard outputs
+
+    outname : str
+        final output h5 file. if None, shards are not combined.
+
+    files_per_shard : int
+        number of files in one shard
+
+    nodenames : list of str
+        nodes to merge, see plan_shards
+
+    shards : list of int
+        shards to merge. if None, all shards.
+
+    workers : int
+        if larger than 1, shards are merged in this number
+        of worker processes.
+
+    kwargs :
+        chunk_rows, complib, complevel and chunkshape
+        passed to merge_files
+
+    Returns
+    ----------
+    missing : list of int
+        shards not done yet. outname is written only if empty.
+    """
+    plan = plan_shards(tablelist, workdir, files_per_shard, nodenames)
+    nshards = len(plan["shards"])
+    if shards is None :
+        shards = range(nshards)
+    todo = [i for i in shards if not os.path.exists(_shard_name(workdir, i, ".json"))]
+
+    arglist = [(workdir, i, kwargs) for i in todo]
+    if workers > 1 and len(todo) > 1 :
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor :
+            results = list(_imap(executor, _merge_shard_job, arglist, 2*workers))
+    else :
+        results = [_merge_shard_job(*args) for args in arglist]
+
+    for ishard, result in zip(todo, results) :
+        if isinstance(result, str) :
+            print("merge_sharded: shard %d failed (%s), rerun to retry" % (ishard, result))
+        elif result is None :
+            print("merge_sharded: shard %d is being merged by another job" % (ishard))
+        else :
+            print("merge_sharded: shard %d/%d done, %d files merged, %d quarantined" % 
+                  (ishard, nshards, result["files"], result["quarantined"]))
+
+    missing = [i for i in range(nshards) if not os.path.exists(_shard_name(workdir, i, ".json"))]
+    if len(missing) > 0 :
+        print("merge_sharded: %d/%d shards are not done" % (len(missing), nshards))
+        return missing
+
+    if outname is not None and not os.path.exists(outname) :
+        # only one of jobs that finish the last shards combines them
+        claimname = os.path.join(workdir, "final.claim")
+        if not _claim(claimname) :
+            print("merge_sharded: %s is being written by another job" % (outname))
+            return missing
+        try :
+            if not os.path.exists(outname) :
+                shardfiles = [_shard_name(workdir, i, ".h5") for i in range(nshards)]
+                shardfiles = [f for f in shardfiles if os.path.exists(f)]
+                merge_files(shardfiles, outname, plan["nodes"], **kwargs)
+        finally :
+            os.remove(claimname)
+    return missing
+
+#--------------------------------------------------
+class _LazyColumn() :
+    """
+    Base of columns that behave like a numpy array but
+    materialize only the touched rows. Subclasses set
+    dtype, shape and ndim and implement _read_range(start, stop)
+    and _read_coordinates(indices).
+    """
+    def __len__(self) :
+        return self.shape[0]
+
+    def __getitem__(self, key) :
+        nrows = len(self)
+        if isinstance(key, (int, np.integer)) :
+            if key < 0 :
+                key += nrows
+            if key < 0 or key >= nrows :
+                raise IndexError("index %d is out of bounds for size %d" % (key, nrows))
+            return self._read_range(key, key + 1)[0]
+
+        if isinstance(key, slice) :
+            start, stop, step = key.indices(nrows)
+            if step == 1 :
+                return self._read_range(start, stop)
+            return self._read_coordinates(np.arange(start, stop, step))
+
+        key = np.asarray(key)
+        if key.dtype == bool :
+            if key.shape != (nrows,) :
+                raise IndexError("boolean index has %d elements, expected %d" % (key.size, nrows))
+            key = np.nonzero(key)[0]
+        elif key.dtype.kind in "iu" :
+            key = np.where(key < 0, key + nrows, key)
+            if key.size > 0 and (key.min() < 0 or key.max() >= nrows) :
+                raise IndexError("index is out of bounds for size %d" % (nrows))
+        else :
+            raise IndexError("unsupported index type %s" % (key.dtype))
+        return self._read_coordinates(key.ravel()).reshape(key.shape + self.shape[1:])
+
+    def iter_chunks(self, chunk_rows=READ_CHUNK_ROWS, prefetch=0) :
+        """
+        iterate over the column by numpy arrays of
+        at most chunk_rows rows.
+        if prefetch > 0, up to prefetch next chunks are read
+        by a background thread, see iter_chunks.
+        """
+        chunks = (self._read_range(start, min(start + chunk_rows, len(self)))
+                  for start in range(0, len(self), chunk_rows))
+        if prefetch > 0 :
+            chunks = _prefetch(chunks, prefetch)
+        for chunk in chunks :
+            yield chunk
+
+    def __iter__(self) :
+        for chunk in self.iter_chunks() :
+            for value in chunk :
+                yield value
+
+    def __array__(self, dtype=None, copy=None) :
+        buf = self._read_range(0, len(self))
+        if dtype is not None :
+            buf = buf.astype(dtype, copy=False)
+        return buf
+
+#--------------------------------------------------
+class ChainedColumn(_LazyColumn) :
+    """
+    Lazy concatenated view of one leaf over many h5 files.
+    It behaves like a 1D numpy array (len, slicing, fancy 
+    indexing, iteration and np.asarray), but holds only 
+    row offsets of each file and reads only the touched
+    slices. Use chain_tables to make it.
+    """
+    def __init__(self, tablelist, nodename, leafname, pool=None, zonemap=None) :
+        self.nodename = _nodepath(nodename)
+        self.leafname = leafname
+        # files are opened in a pool of the column unless given
+        self.owned = pool is None
+        self.pool = TablePool() if pool is None else pool
+        self.zonemap = zonemap
+        sources = _count_rows(tablelist, [self.nodename], pool=self.pool)
+        self.sources = [src for src, nrows in sources]
+        self.offsets = np.cumsum([0] + [nrows[self.nodename] for src, nrows in sources])
+
+        self.dtype = np.dtype(float)
+        self.shape = (int(self.offsets[-1]),)
+        if len(self.sources) > 0 :
+            if _is_manifest(tablelist) :
+                entry = [e for e in tablelist["files"] if not e["empty"]][0]
+                leaves = _manifest_node(entry, self.nodename)["leaves"]
+                coldtype, colshape = leaves[leafname]
+                self.dtype = np.dtype(coldtype)
+                self.shape += tuple(colshape)
+            else :
+                myt = _handle(self.sources[0], self.pool)
+                coltype = myt.get_node(self.nodename).coldtypes[leafname]
+                self.dtype = coltype.base
+                self.shape += coltype.shape
+        self.ndim = len(self.shape)
+
+    def __repr__(self) :
+        return "ChainedColumn(%s/%s, %d rows in %d files)" % (self.nodename, self.leafname, 
+                                                             len(self), len(self.sources))
+
+    def close(self) :
+        """
+        close files opened by the column. the pool given by
+        the caller is left open. the column can be read 
+        again, files are reopened.
+        """
+        if self.owned :
+            self.pool.close()
+
+    def __del__(self) :
+        if getattr(self, "owned", False) :
+            self.pool.close()
+
+    def _read_range(self, start, stop) :
+        """
+        read rows [start, stop) 
+        """
+        out = np.empty((max(stop - start, 0),) + self.shape[1:], dtype=self.dtype)
+        if stop <= start :
+            return out
+        first = np.searchsorted(self.offsets, start, side="right") - 1
+        last = np.searchsorted(self.offsets, stop, side="left")
+        for ifile in range(first, last) :
+            lo = max(start, self.offsets[ifile])
+            hi = min(stop, self.offsets[ifile+1])
+            if hi <= lo :
+                continue
+            node = _handle(self.sources[ifile], self.pool).get_node(self.nodename)
+            node.read(lo - self.offsets[ifile], hi - self.offsets[ifile], 
+                      field=self.leafname, out=out[lo-start:hi-start])
+        return out
+
+    def _read_coordinates(self, indices) :
+        """
+        read rows at indices (1D int array, any order)
+        """
+        out = np.empty((len(indices),) + self.shape[1:], dtype=self.dtype)
+        order = np.argsort(indices, kind="stable")
+        sorted_indices = indices[order]
+        ifiles = np.searchsorted(self.offsets, sorted_indices, side="right") - 1
+        bounds = np.searchsorted(ifiles, np.arange(len(self.sources) + 1))
+        for ifile in range(len(self.sources)) :
+            lo, hi = bounds[ifile], bounds[ifile+1]
+            if hi <= lo :
+                continue
+            node = _handle(self.sources[ifile], self.pool).get_node(self.nodename)
+            rows = node.read_coordinates(sorted_indices[lo:hi] - self.offsets[ifile], field=self.leafname)
+            out[order[lo:hi]] = rows
+        return out
+
+    def minmax(self) :
+        """
+        min and max of the column. if the zone map covers
+        all files and none of them is modified after the zone
+        map was made, it's answered without reading events,
+        otherwise the column is read chunk by chunk.
+        """
+        if self.zonemap is not None :
+            filenames = [os.path.abspath(f) for f in _filenames(self.sources)]
+            entries = dict([(e["name"], e) for e in self.zonemap["files"]])
+            if all([f in entries and self.nodename in entries[f]["stats"] and
+                    self.leafname in entries[f]["stats"][self.nodename] and
+                    not _zonemap_changed(entries[f]) for f in filenames]) :
+                vmin, vmax = zonemap_stats(self.zonemap, self.nodename, self.leafname, filenames)[:2]
+                if vmin is not None :
+                    return vmin, vmax
+        vmin = np.inf
+        vmax = -np.inf
+        for chunk in self.iter_chunks() :
+            if len(chunk) > 0 :
+                vmin = min(vmin, np.nanmin(chunk))
+                vmax = max(vmax, np.nanmax(chunk))
+        return vmin, vmax
+
+#--------------------------------------------------
+def chain_tables(tablelist, nodename, leafname, pool=None, zonemap=None) :
+    """
+    Make a lazy view of leafname concatenated over tables.
+    Unlike read_tables, nothing is read until the rows
+    are accessed, so it works for samples that do not 
+    fit in memory and for quick looks at first N events.
+
+    Parameters
+    ----------
+    tablelist : str or list of tables or list of str or dict
+        same as read_tables
+
+    nodename : str
+        name of branch of h5 file
+
+    leafname : str
+        name of leaf of h5 file
+
+    pool : TablePool
+        pool to open files. if None, the column opens files 
+        in its own pool, call column.close() to close them.
+
+    zonemap : dict
+        return value of build_zonemap. if given, 
+        column.minmax() (used by HistTools for auto-ranging)
+        is answered from the zone map.
+
+    Returns
+    ----------
+    column : ChainedColumn
+        e.g. column[:100], column[mask], np.asarray(column),
+        for chunk in column.iter_chunks() : ...
+
+    """
+    return ChainedColumn(tablelist, nodename, leafname, pool, zonemap)
+
+#--------------------------------------------------
+def _compress_block(block, codec, clevel) :
+    if codec == "blosc2" :
+        import blosc2
+        return blosc2.compress(block, typesize=block.dtype.itemsize, clevel=clevel,
+                               filter=blosc2.Filter.BITSHUFFLE, codec=blosc2.Codec.LZ4)
+    return zlib.compress(block.tobytes(), clevel)
+
+#--------------------------------------------------
+def _decompress_block(data, codec) :
+    if codec == "blosc2" :
+        import blosc2
+        return blosc2.decompress(data)
+    return zlib.decompress(data)
+
+#--------------------------------------------------
+def _default_codec() :
+    """
+    blosc2 (installed with recent PyTables) if available, else zlib
+    """
+    try :
+        import blosc2
+        return "blosc2"
+    except ImportError :
+        return "zlib"
+
+#--------------------------------------------------
+class CompressedColumn(_LazyColumn) :
+    """
+    In-memory column compressed block by block.
+    It behaves like a 1D numpy array as ChainedColumn does,
+    and only the touched blocks are decompressed, so 
+    HistTools functions iterate over it chunk by chunk.
+    Columns with few distinct values (PDG codes, interaction
+    types, quantized angles) are typically a few times
+    smaller than numpy arrays.
+    Use compress_column or read_compressed to make it.
+    """
+    def __init__(self, dtype, shape=(), codec=None, clevel=5, block_rows=COMPRESS_BLOCK_ROWS) :
+        self.dtype = np.dtype(dtype)
+        self.shape = (0,) + tuple(shape)
+        self.ndim = len(self.shape)
+        self.codec = codec if codec is not None else _default_codec()
+        self.clevel = clevel
+        self.block_rows = block_rows
+        self.blocks = []
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.ranges = [] # [min, max] of each block
+        self._last = None # last decompressed block, (iblock, array)
+
+    def __repr__(self) :
+        return "CompressedColumn(%d rows, %s, %s, %.1f times smaller)" % (len(self), self.dtype, 
+                                                                         self.codec, self.ratio)
+
+    @property
+    def nbytes(self) :
+        """
+        size of compressed blocks
+        """
+        return sum([len(b) for b in self.blocks])
+
+    @property
+    def ratio(self) :
+        """
+        uncompressed size / compressed size
+        """
+        return len(self) * self.dtype.itemsize * int(np.prod(self.shape[1:])) / float(max(self.nbytes, 1))
+
+    def append(self, buf) :
+        """
+        compress rows of buf and append them
+        """
+        buf = np.asarray(buf, dtype=self.dtype)
+        if buf.shape[1:] != self.shape[1:] :
+            raise ValueError("shape of rows %s differs from %s" % (buf.shape[1:], self.shape[1:]))
+        nrows = len(self)
+        offsets = [self.offsets]
+        for start in range(0, len(buf), self.block_rows) :
+            block = np.ascontiguousarray(buf[start:start + self.block_rows])
+            self.blocks.append(_compress_block(block, self.codec, self.clevel))
+            vmin = vmax = None
+            if self.dtype.kind in "iufb" and np.isfinite(block).any() :
+                vmin = np.nanmin(block).item()
+                vmax = np.nanmax(block).item()
+            self.ranges.append([vmin, vmax])
+            nrows += len(block)
+            offsets.append([nrows])
+        self.offsets = np.concatenate(offsets)
+        self.shape = (nrows,) + self.shape[1:]
+
+    def _block(self, iblock) :
+        if self._last is None or self._last[0] != iblock :
+            data = _decompress_block(self.blocks[iblock], self.codec)
+            nrows = self.offsets[iblock+1] - self.offsets[iblock]
+            block = np.frombuffer(data, dtype=self.dtype).reshape((nrows,) + self.shape[1:])
+            self._last = (iblock, block)
+        return self._last[1]
+
+    def _read_range(self, start, stop) :
+        """
+        decompress rows [start, stop) 
+        """
+        out = np.empty((max(stop - start, 0),) + self.shape[1:], dtype=self.dtype)
+        if stop <= start :
+            return out
+        first = np.searchsorted(self.offsets, start, side="right") - 1
+        last = np.searchsorted(self.offsets, stop, side="left")
+        for iblock in range(first, last) :
+            lo = max(start, self.offsets[iblock])
+            hi = min(stop, self.offsets[iblock+1])
+            if hi <= lo :
+                continue
+            block = self._block(iblock)
+            out[lo-start:hi-start] = block[lo - self.offsets[iblock]:hi - self.offsets[iblock]]
+        return out
+
+    def _read_coordinates(self, indices) :
+        """
+        decompress rows at indices (1D int array, any order)
+        """
+        out = np.empty((len(indices),) + self.shape[1:], dtype=self.dtype)
+        order = np.argsort(indices, kind="stable")
+        sorted_indices = indices[order]
+        iblocks = np.searchsorted(self.offsets, sorted_indices, side="right") - 1
+        bounds = np.searchsorted(iblocks, np.arange(len(self.blocks) + 1))
+        for iblock in range(len(self.blocks)) :
+            lo, hi = bounds[iblock], bounds[iblock+1]
+            if hi <= lo :
+                continue
+            out[order[lo:hi]] = self._block(iblock)[sorted_indices[lo:hi] - self.offsets[iblock]]
+        return out
+
+    def minmax(self) :
+        """
+        min and max of the column from ranges of blocks,
+        without decompressing them
+        """
+        vmins = [r[0] for r in self.ranges if r[0] is not None]
+        vmaxs = [r[1] for r in self.ranges if r[1] is not None]
+        if len(vmins) == 0 :
+            return np.inf, -np.inf
+        return min(vmins), max(vmaxs)
+
+    def __getstate__(self) :
+        state = self.__dict__.copy()
+        state["_last"] = None
+        return state
+
+#--------------------------------------------------
+def compress_column(buf, codec=None, clevel=5, block_rows=COMPRESS_BLOCK_ROWS) :
+    """
+    Compress a numpy array to CompressedColumn.
+
+    Parameters
+    ----------
+    buf : numpy array
+        e.g. return value of read_tables
+
+    codec : str
+        "blosc2" (LZ4 with bit shuffle) or "zlib".
+        if None, blosc2 is used if it's installed.
+
+    clevel : int
+        compression level, 0-9
+
+    block_rows : int
+        number of rows compressed together. smaller blocks
+        make random access faster and ratio worse.
+
+    Returns
+    ----------
+    column : CompressedColumn
+    """
+    buf = np.asarray(buf)
+    column = CompressedColumn(buf.dtype, buf.shape[1:], codec, clevel, block_rows)
+    column.append(buf)
+    return column
+
+#--------------------------------------------------
+def read_compressed(tablelist, nodename, leafnames, codec=None, clevel=5, 
+                    block_rows=COMPRESS_BLOCK_ROWS, pool=None, dtype=None) :
+    """
+    Read leaves of nodename as CompressedColumns.
+    Rows are read and compressed chunk by chunk with 
+    iter_chunks, so uncompressed columns never exist 
+    in memory as a whole.
+
+    Parameters
+    ----------
+    tablelist : str or list of tables or list of str or dict
+        same as read_tables
+
+    nodename : str
+        name of branch of h5 file
+
+    leafnames : list of str
+        leaves to read
+
+    codec, clevel, block_rows :
+        see compress_column
+
+    pool : TablePool
+        pool to open files. if None, files are closed
+        before returning.
+
+    dtype : dtype or dict
+        cast leaves before compression, see read_tables_multi
+
+    Returns
+    ----------
+    columns : dict
+        {leafname: CompressedColumn}
+    """
+    columns = {}
+    for offset, chunk in iter_chunks(tablelist, nodename, leafnames, block_rows, pool=pool, dtype=dtype) :
+        for leafname in leafnames :
+            buf = chunk[leafname]
+            if not leafname in columns :
+                columns[leafname] = CompressedColumn(buf.dtype, buf.shape[1:], codec, clevel, block_rows)
+            columns[leafname].append(buf)
+    for leafname in leafnames :
+        if not leafname in columns :
+            # no table is filled
+            columns[leafname] = CompressedColumn(float, (), codec, clevel, block_rows)
+    return columns
+
+#--------------------------------------------------
+def _put_unless_stopped(q, item, stop) :
+    """
+    put item to the queue q, give up if stop is set.
+    returns True if the item is put.
+    """
+    while not stop.is_set() :
+        try :
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full :
+            continue
+    return False
+
+#--------------------------------------------------
+def _prefetch(generator, depth) :
+    """
+    Run generator in a background thread and yield its items,
+    so that reading the next items overlaps with the processing
+    of the current item by the caller. At most depth items are 
+    read ahead. Exceptions in the thread are raised in the caller.
+    Note that h5 files must not be read by other threads while 
+    the generator is running, as PyTables is not thread-safe.
+    """
+    q = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    end = object()
+
+    def worker() :
+        try :
+            for item in generator :
+                if not _put_unless_stopped(q, (item, None), stop) :
+                    return
+            _put_unless_stopped(q, (end, None), stop)
+        except Exception as e :
+            _put_unless_stopped(q, (end, e), stop)
+
+    thread = threading.Thread(target=worker)
+    thread.daemon = True
+    thread.start()
+    try :
+        while True :
+            item, error = q.get()
+            if item is end :
+                if error is not None :
+                    raise error
+                return
+            yield item
+    finally :
+        stop.set()
+        thread.join()
+
+#--------------------------------------------------
+def _iter_file_blocks(sources, nodename, leafnames, block_rows, pool=None, dtypes=None) :
+    """
+    Read leaves of nodename file by file and yield blocks
+    of at most block_rows rows in file order.
+
+    Parameters
+    ----------
+    sources : list
+        return value of _count_rows
+
+    Returns
+    ----------
+    generator of dict {leafname: numpy array}
+    """
+    for src, nrows in sources :
+        node = _handle(src, pool).get_node(nodename)
+        # rows counted in the first pass, rows appended later are not read
+        nrows = _counted_rows(node, nrows[nodename])
+        for first in range(0, nrows, block_rows) :
+            last = min(first + block_rows, nrows)
+            outs = _allocate_leaves(node, leafnames, last - first, dtypes)
+            leafname = leafnames[0]
+            if len(leafnames) == 1 and outs[leafname].dtype == node.coldtypes[leafname].base :
+                node.read(first, last, field=leafname, out=outs[leafname])
+            elif len(leafnames) == 1 :
+                outs[leafname][:] = node.read(first, last, field=leafname)
+            else :
+                rows = node.read(first, last)
+                for leafname in leafnames :
+                    outs[leafname][:] = rows[leafname]
+            yield outs
+
+#--------------------------------------------------
+def iter_chunks(tablelist, nodename, leafnames, chunk_rows=1000000, prefetch=0, pool=None, dtype=None) :
+    """
+    Iterate leaves of nodename over all tables by aligned 
+    chunks of bounded size. Chunks are filled across file 
+    boundaries, so every chunk has chunk_rows rows except
+    the last one. Memory usage doesn't depend on the
+    total number of rows.
+
+    Parameters
+    ----------
+    tablelist : str or list of tables or list of str or dict
+        same as read_tables
+
+    nodename : str
+        name of branch of h5 file
+
+    leafnames : str or list of str
+        names of leaves of h5 file
+
+    chunk_rows : int
+        number of rows of each chunk
+
+    prefetch : int
+        if larger than 0, a background thread opens and reads
+        up to this number of next file blocks while the caller
+        processes the current chunk, so that I/O latency 
+        overlaps with computation. Don't read h5 files in the
+        loop body when prefetch is used.
+
+    pool : TablePool
+        pool to open files. if None, files are closed
+        when the iteration ends.
+
+    dtype : dtype or dict
+        cast leaves while reading, see read_tables_multi
+
+    Returns
+    ----------
+    generator of (offset, chunk)
+        offset : int
+            global row index of the first row of the chunk
+        chunk : dict
+            {leafname: numpy array with at most chunk_rows rows}
+
+    Usage:
+        for offset, chunk in iter_chunks(files, "MCPrimary", ["energy", "zenith"]) :
+            hist += np.histogram(chunk["energy"], bins)[0]
+
+    """
+    nodename = _nodepath(nodename)
+    if isinstance(leafnames, str) :
+        leafnames = [leafnames]
+
+    with _scoped_pool(pool) as pool :
+        sources = _count_rows(tablelist, [nodename], pool=pool)
+        total = sum([nrows[nodename] for src, nrows in sources])
+        dtypes = _resolve_dtypes(dtype, {nodename : leafnames})[nodename]
+        blocks = _iter_file_blocks(sources, nodename, leafnames, chunk_rows, pool, dtypes)
+        if prefetch > 0 :
+            blocks = _prefetch(blocks, prefetch)
+
+        try :
+            offset = 0
+            chunk = None
+            filled = 0
+            for block in blocks :
+                nblock = len(block[leafnames[0]])
+                pos = 0
+                while pos < nblock :
+                    size = min(chunk_rows, total - offset)
+                    if size == 0 :
+                        # more rows than counted, should not happen
+                        return
+                    if chunk is None and nblock - pos >= size :
+                        # the block covers the whole chunk, no copy
+                        yield offset, dict([(l, block[l][pos:pos+size]) for l in leafnames])
+                        offset += size
+                        pos += size
+                        continue
+
+                    if chunk is None :
+                        chunk = dict([(l, np.empty((size,) + block[l].shape[1:], dtype=block[l].dtype)) 
+                                      for l in leafnames])
+                        filled = 0
+                    ncopy = min(nblock - pos, size - filled)
+                    for leafname in leafnames :
+                        chunk[leafname][filled:filled+ncopy] = block[leafname][pos:pos+ncopy]
+                    filled += ncopy
+                    pos += ncopy
+                    if filled == size :
+                        yield offset, chunk
+                        offset += size
+                        chunk = None
+        finally :
+            # stop reading (and the prefetch thread) before the pool is closed
+            blocks.close()
+
+#--------------------------------------------------
+def _load_pickle(fname) :
+    """
+    load a pickle file in binary mode.
+    numpy arrays pickled with python2 are decoded with latin1.
+    """
+    with open(fname, "rb") as f :
+        return pickle.load(f, encoding="latin1")
+
+#--------------------------------------------------
+def read_pickles(tablelist, leafname) :
+    """
+    Read data named leafname from dictionaries and merge 
+    them to one (n, 1) array
+    If tablelist is string, it loads only one dictionary
+    at a time and keeps only the leafname of it.
+    For large datasets, convert pickles once with 
+    convert_pickles and use read_npydirs.
+
+    Parameters
+    ----------
+    tablelist : str or list of tables
+        filename of list of pickles files or 
+        filename that contains wildcard or
+        list of opened dictionaries 
+
+    leafname : str
+        name of key of dictionary
+
+    Returns
+    ----------
+    buf : (n, 1) numpy array
+
+    """
+
+    bufs = []
+
+    if isinstance(tablelist, str) :
+        '''
+        load one pickle at a time, slow but 
+        uses less runtime memory
+        '''
+        filenames = glob_filenames(tablelist) 
+        for i, fname in enumerate(filenames):
+            #print("open file %s" % (fname))
+            bufs.append(_load_pickle(fname)[leafname])
+
+    else :
+        '''
+        tablelist is list of dictionary filled with 
+        load_tables.
+        fast, but uses more runtime memory
+        '''
+        for i, t in enumerate(tablelist):
+            #print i, t
+            bufs.append(t[leafname])
+
+    # merge once, not per file
+    buf = np.hstack(bufs)
+    print( leafname, buf.shape)
+
+    return buf
+
+#--------------------------------------------------
+def _npydir_name(fname, outdir=None) :
+    """
+    name of the directory converted from a pickle file,
+    e.g. dir/foo.pkl -> outdir/foo.npydir
+    """
+    base = os.path.splitext(os.path.basename(fname))[0] + ".npydir"
+    if outdir is None :
+        return os.path.join(os.path.dirname(fname), base)
+    return os.path.join(outdir, base)
+
+#--------------------------------------------------
+def convert_pickles(tablelist, outdir=None) :
+    """
+    Convert pickled dictionaries to columnar directories.
+    Each pickle file foo.pkl becomes a directory foo.npydir
+    that contains one .npy file per key of the dictionary,
+    which can be memory-mapped by read_npydirs.
+    Pickles already converted and not modified after the
+    conversion are skipped. A directory is written as
+    foo.npydir.tmp and renamed when the conversion is complete.
+
+    Parameters
+    ----------
+    tablelist : str
+        filename of list of pickles files or 
+        filename that contains wildcard
+
+    outdir : str
+        directory to store converted directories.
+        if None, they are made next to the pickle files.
+
+    Returns
+    ----------
+    dirnames : list of str
+        converted directories in the order of pickle files
+
+    """
+    if outdir is not None and not os.path.exists(outdir) :
+        os.makedirs(outdir)
+
+    dirnames = []
+    for fname in glob_filenames(tablelist) :
+        dirname = _npydir_name(fname, outdir)
+        dirnames.append(dirname)
+        if os.path.exists(dirname) and os.path.getmtime(dirname) >= os.path.getmtime(fname) :
+            continue
+
+        # convert into a temporary directory and rename it when
+        # complete, so that an interrupted conversion is redone
+        tmpname = dirname + ".tmp"
+        if os.path.exists(tmpname) :
+            shutil.rmtree(tmpname)
+        os.makedirs(tmpname)
+        myt = _load_pickle(fname)
+        for key, value in myt.items() :
+            arr = np.asarray(value)
+            if arr.dtype.hasobject :
+                print("convert_pickles: %s of %s is not a numeric array, skipped" % (key, fname))
+                continue
+            np.save(os.path.join(tmpname, "%s.npy" % key), arr)
+        if os.path.exists(dirname) :
+            shutil.rmtree(dirname)
+        os.rename(tmpname, dirname)
+        # mark the conversion time
+        os.utime(dirname, None)
+
+    print("convert_pickles: %d pickles" % (len(dirnames)))
+    return dirnames
+
+#--------------------------------------------------
+def read_npydirs(dirlist, leafname) :
+    """
+    Read leafname from directories made by convert_pickles
+    and merge them to one (n, 1) array.
+    Only leafname.npy of each directory is memory-mapped,
+    and the merged array is allocated once and filled.
+
+    Parameters
+    ----------
+    dirlist : str or list of str
+        directory name with wildcard (e.g. "out/*.npydir") or
+        list of directory names returned by convert_pickles
+
+    leafname : str
+        name of key of the original dictionary
+
+    Returns
+    ----------
+    buf : (n, 1) numpy array
+
+    """
+    if isinstance(dirlist, str) :
+        dirlist = sorted(glob.glob(dirlist))
+
+    npynames = [os.path.join(d, "%s.npy" % leafname) for d in dirlist]
+    nrows = []
+    dtype = None
+    shape = ()
+    for npyname in npynames :
+        arr = np.load(npyname, mmap_mode="r")
+        arr = np.atleast_1d(arr)
+        nrows.append(len(arr))
+        if dtype is None :
+            dtype = arr.dtype
+            shape = arr.shape[1:]
+        del arr
+
+    if dtype is None :
+        return np.zeros(0)
+
+    buf = np.empty((sum(nrows),) + shape, dtype=dtype)
+    start = 0
+    for npyname, n in zip(npynames, nrows) :
+        buf[start:start+n] = np.atleast_1d(np.load(npyname, mmap_mode="r"))
+        start += n
+
+    print(leafname, buf.shape)
+    return buf
+
+#--------------------------------------------------
+# default key leaves to identify an event
+EVENT_KEYS = ("Run", "Event", "SubEvent")
+
+class KeyIndex() :
+    """
+    Sorted index of integer keys of one table, e.g. 
+    (Run, Event, SubEvent). Rows are sorted once with 
+    lexsort and the index can be joined with other
+    indices many times, see join_index.
+
+    Attributes
+    ----------
+    keys : list of numpy array
+        key columns sorted lexicographically
+
+    order : numpy array
+        row numbers of the sorted keys, keys[i] == key_columns[i][order]
+
+    unique : bool
+        True if there is no duplicated key
+    """
+    def __init__(self, keys) :
+        keys = [np.asarray(k) for k in keys]
+        for k in keys :
+            if k.dtype.kind not in "iub" :
+                raise ValueError("KeyIndex: keys must be integers, got %s" % k.dtype)
+        widths = _key_widths([keys])
+        if widths is not None :
+            # sorting packed keys is much faster than lexsort
+            self.order = np.argsort(_pack_uint64(keys, widths), kind="stable")
+        else :
+            # lexsort takes the primary key last
+            self.order = np.lexsort(keys[::-1])
+        self.keys = [k[self.order] for k in keys]
+        self.unique = True
+        if len(self) > 1 :
+            same = np.ones(len(self) - 1, dtype=bool)
+            for k in self.keys :
+                same &= k[1:] == k[:-1]
+            self.unique = not same.any()
+
+    def __len__(self) :
+        return len(self.order)
+
+    def __repr__(self) :
+        return "KeyIndex(%d rows, %d keys)" % (len(self), len(self.keys))
+
+#--------------------------------------------------
+def _key_widths(keylists) :
+    """
+    bit widths of each key to pack keys of all keylists
+    to uint64, None if keys are negative or don't fit.
+    """
+    widths = []
+    for i in range(len(keylists[0])) :
+        vmax = 0
+        for keys in keylists :
+            if len(keys[i]) > 0 :
+                if keys[i].min() < 0 :
+                    return None
+                vmax = max(vmax, int(keys[i].max()))
+        widths.append(max(vmax.bit_length(), 1))
+    if sum(widths) > 64 :
+        return None
+    return widths
+
+#--------------------------------------------------
+def _pack_uint64(keys, widths) :
+    """
+    pack key columns to one uint64 array, keeping lexicographic order
+    """
+    packed = np.zeros(len(keys[0]), dtype=np.uint64)
+    for k, width in zip(keys, widths) :
+        packed <<= np.uint64(width)
+        packed |= k.astype(np.uint64)
+    return packed
+
+#--------------------------------------------------
+def _pack_keys(indices) :
+    """
+    Pack sorted keys of indices to one comparable array each.
+    If bit widths of all keys fit in 64 bits, keys are packed
+    to uint64 with the same widths for all indices, otherwise
+    they are packed to structured arrays (slower comparisons).
+    Lexicographic order is kept in both cases.
+    """
+    nkeys = len(indices[0].keys)
+    for index in indices :
+        if len(index.keys) != nkeys :
+            raise ValueError("number of keys differs, %d and %d" % (nkeys, len(index.keys)))
+
+    widths = _key_widths([index.keys for index in indices])
+    return [_pack_with(index.keys, widths) for index in indices]
+
+#--------------------------------------------------
+def _pack_with(keys, widths) :
+    """
+    pack key columns to uint64 with widths, or to 
+    a structured array of int64 if widths is None
+    """
+    if widths is not None :
+        return _pack_uint64(keys, widths)
+    packed = np.empty(len(keys[0]), dtype=[("k%d" % i, np.int64) for i in range(len(keys))])
+    for i, k in enumerate(keys) :
+        packed["k%d" % i] = k
+    return packed
+
+#--------------------------------------------------
+def join_index(left, right, how="inner") :
+    """
+    Vectorized merge-join of two KeyIndex.
+
+    Parameters
+    ----------
+    left, right : KeyIndex
+        keys of right must be unique
+
+    how : str
+        "inner" : rows of left that have a match in right
+        "left"  : all rows of left
+        "outer" : all rows of left, followed by rows of 
+                  right without a match in left
+
+    Returns
+    ----------
+    lrows, rrows : numpy array of int64
+        row numbers of left and right tables for each
+        joined row, -1 if there is no row in the table.
+        rows of left keep their original order.
+    """
+    if not how in ("inner", "left", "outer") :
+        raise ValueError("how must be inner, left or outer, got %s" % how)
+    if not right.unique :
+        raise ValueError("keys of right table are not unique")
+
+    lkeys, rkeys = _pack_keys([left, right])
+    pos = np.searchsorted(rkeys, lkeys)
+    pos[pos == len(rkeys)] = 0
+    matched = np.zeros(len(lkeys), dtype=bool)
+    if len(rkeys) > 0 :
+        matched = rkeys[pos] == lkeys
+
+    # back to the original order of left
+    rrows = np.full(len(left), -1, dtype=np.int64)
+    rrows[left.order[matched]] = right.order[pos[matched]]
+    lrows = np.arange(len(left), dtype=np.int64)
+
+    if how == "inner" :
+        found = rrows >= 0
+        lrows = lrows[found]
+        rrows = rrows[found]
+    elif how == "outer" :
+        used = np.zeros(len(right), dtype=bool)
+        used[rrows[rrows >= 0]] = True
+        extra = np.flatnonzero(~used).astype(np.int64)
+        lrows = np.concatenate([lrows, np.full(len(extra), -1, dtype=np.int64)])
+        rrows = np.concatenate([rrows, extra])
+    return lrows, rrows
+
+#--------------------------------------------------
+def _take_rows(buf, rows) :
+    """
+    buf[rows], rows of -1 are filled with NaN for floats
+    and 0 for other types
+    """
+    out = buf[np.maximum(rows, 0)] if len(buf) > 0 else \
+          np.zeros((len(rows),) + buf.shape[1:], dtype=buf.dtype)
+    missing = rows < 0
+    if missing.any() :
+        out[missing] = np.nan if out.dtype.kind in "fc" else 0
+    return out
+
+#--------------------------------------------------
+def key_index(tablelist, nodename, keynames=EVENT_KEYS, **kwargs) :
+    """
+    Read key leaves of nodename and make a KeyIndex.
+    kwargs are passed to read_tables_multi.
+    """
+    bufs = read_tables_multi(tablelist, {nodename : list(keynames)}, **kwargs)[nodename]
+    return KeyIndex([bufs[k] for k in keynames])
+
+#--------------------------------------------------
+def join_tables(left, leftnode, leftleaves, right, rightnode, rightleaves, 
+                keynames=EVENT_KEYS, how="inner", **kwargs) :
+    """
+    Line up rows of two nodes by keys instead of row order,
+    e.g. truth from one production and reconstruction from 
+    another. Key leaves and requested leaves of each side
+    are read with read_tables_multi, a KeyIndex is built
+    for each side and joined with join_index. 
+    No python loop runs over rows.
+
+    Parameters
+    ----------
+    left, right : str or list of tables or list of str or dict
+        tablelists of each side, same as read_tables.
+        can be the same files to join different nodes.
+
+    leftnode, rightnode : str
+        nodes of each side
+
+    leftleaves, rightleaves : list of str
+        leaves to read from each side
+
+    keynames : list of str
+        key leaves that must exist in both nodes
+
+    how : str
+        "inner", "left" or "outer", see join_index.
+        keys of right must be unique.
+
+    kwargs :
+        passed to read_tables_multi, e.g. workers, dtype
+
+    Returns
+    ----------
+    lbufs, rbufs : dict
+        {leafname: numpy array} aligned row by row.
+        values of missing rows are NaN for floats and 0 for others.
+
+    lmask, rmask : numpy array of bool
+        True where the joined row has a row of left (right).
+
+    """
+    lbufs = read_tables_multi(left, {leftnode : list(keynames) + list(leftleaves)}, **kwargs)[leftnode]
+    rbufs = read_tables_multi(right, {rightnode : list(keynames) + list(rightleaves)}, **kwargs)[rightnode]
+    lrows, rrows = join_index(KeyIndex([lbufs[k] for k in keynames]), 
+                              KeyIndex([rbufs[k] for k in keynames]), how)
+
+    lout = dict([(l, _take_rows(lbufs[l], lrows)) for l in leftleaves])
+    rout = dict([(l, _take_rows(rbufs[l], rrows)) for l in rightleaves])
+    return lout, rout, lrows >= 0, rrows >= 0
+
+#--------------------------------------------------
+class EventIndex() :
+    """
+    On-disk index from event keys, e.g. (Run, Event), to
+    (file, row) over many h5 files. It's made and updated
+    with build_event_index and loaded with load_event_index.
+    Arrays are memory-mapped, so a lookup touches only
+    a few pages of the index and fetch_events opens only
+    the files that have the requested events.
+
+    Files in indexdir
+    ----------
+    events.json : {"node", "keys", "widths", "version", "files" : [{"name", "size", "mtime"}]}
+    events.<version>.npy : structured array of keys, "file" and "row", sorted by keys
+    events.<version>.key.npy : keys packed to uint64 (or structured if they don't fit)
+
+    Each build writes arrays of a new version and switches
+    to them by renaming events.json, so a reader sees
+    either the old index or the new one.
+    """
+    def __init__(self, indexdir) :
+        self.indexdir = indexdir
+        with open(os.path.join(indexdir, "events.json")) as f :
+            meta = json.load(f)
+        self.nodename = meta["node"]
+        self.keynames = meta["keys"]
+        self.widths = meta["widths"]
+        self.files = [e["name"] for e in meta["files"]]
+        self.meta = meta
+        base = "events"
+        if "version" in meta :
+            base = "events.%s" % meta["version"]
+        self.arraynames = [os.path.join(indexdir, base + ".npy"), os.path.join(indexdir, base + ".key.npy")]
+        self.events = np.load(self.arraynames[0], mmap_mode="r")
+        self.packed = np.load(self.arraynames[1], mmap_mode="r")
+
+    def __len__(self) :
+        return len(self.events)
+
+    def __repr__(self) :
+        return "EventIndex(%s %s, %d events in %d files)" % (self.nodename, tuple(self.keynames),
+                                                           len(self), len(self.files))
+
+    def lookup(self, events) :
+        """
+        Find rows of events.
+
+        Parameters
+        ----------
+        events : array like of shape (n, nkeys)
+            e.g. [(run, event), ...]
+
+        Returns
+        ----------
+        query, files, rows : numpy arrays
+            for each found row, index of events, file index
+            in self.files and row number in the file.
+            An event may have multiple rows (e.g. SubEvents).
+        """
+        events = np.asarray(events, dtype=np.int64).reshape(-1, len(self.keynames))
+        keys = [events[:, i] for i in range(len(self.keynames))]
+        valid = np.ones(len(events), dtype=bool)
+        if self.widths is not None :
+            # keys out of the packed range are not in the index
+            for k, width in zip(keys, self.widths) :
+                valid &= (k >= 0) & (k < (1 << width))
+            keys = [k[valid] for k in keys]
+        packed = _pack_with(keys, self.widths)
+        first = np.searchsorted(self.packed, packed, side="left")
+        last = np.searchsorted(self.packed, packed, side="right")
+        counts = last - first
+        query = np.repeat(np.flatnonzero(valid), counts)
+        # positions first[i], first[i]+1, ..., last[i]-1 for all i
+        pos = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(first, counts)
+        found = self.events[pos]
+        return query, found["file"].astype(np.int64), found["row"].astype(np.int64)
+
+#--------------------------------------------------
+def load_event_index(indexdir) :
+    """
+    load EventIndex saved with build_event_index
+    """
+    return EventIndex(indexdir)
+
+#--------------------------------------------------
+def build_event_index(manifest, indexdir, nodename="I3EventHeader", keynames=("Run", "Event")) :
+    """
+    Make or update the event index in indexdir.
+    Rows of files whose size and mtime are not changed
+    since the last build are kept, only new or modified
+    files are read, and files not in the manifest are dropped.
+
+    Parameters
+    ----------
+    manifest : dict
+        return value of build_manifest. empty files and 
+        files without nodename are skipped.
+
+    indexdir : str
+        directory of the index
+
+    nodename : str
+        node that has key leaves
+
+    keynames : list of str
+        integer leaves to identify events
+
+    Returns
+    ----------
+    index : EventIndex
+    """
+    nodename = _nodepath(nodename)
+    keynames = list(keynames)
+    metaname = os.path.join(indexdir, "events.json")
+    old = None
+    oldnames = []
+    if os.path.exists(metaname) :
+        old = EventIndex(indexdir)
+        oldnames = old.arraynames
+        if old.nodename != nodename or old.keynames != keynames :
+            # different keys, rebuild
+            old = None
+    else :
+        if not os.path.exists(indexdir) :
+            os.makedirs(indexdir)
+
+    known = {}
+    if old is not None :
+        for i, e in enumerate(old.meta["files"]) :
+            known[e["name"]] = (i, e)
+        # group old rows by file once, rows of file i are
+        # old.events[fileorder[bounds[i]:bounds[i+1]]]
+        fileorder = np.argsort(old.events["file"], kind="stable")
+        bounds = np.searchsorted(old.events["file"][fileorder], 
+                                 np.arange(len(old.meta["files"]) + 1))
+
+    files = []
+    parts = []
+    nread = 0
+    with TablePool() as pool :
+        for entry in manifest["files"] :
+            if entry["empty"] or not nodename in entry["nodes"] :
+                continue
+            ifile = len(files)
+            files.append({"name" : entry["name"], "size" : entry["size"], "mtime" : entry["mtime"]})
+            if entry["name"] in known :
+                iold, e = known[entry["name"]]
+                if e["size"] == entry["size"] and e["mtime"] == entry["mtime"] :
+                    rows = old.events[fileorder[bounds[iold]:bounds[iold+1]]]
+                    rows["file"] = ifile
+                    parts.append(rows)
+                    continue
+            node = _handle(entry["name"], pool).get_node(nodename)
+            bufs = _allocate_leaves(node, keynames, node.nrows)
+            _read_node(node, keynames, bufs, 0)
+            rows = np.empty(node.nrows, dtype=[(k, np.int64) for k in keynames] + 
+                                              [("file", np.int32), ("row", np.int64)])
+            for k in keynames :
+                rows[k] = bufs[k]
+            rows["file"] = ifile
+            rows["row"] = np.arange(node.nrows)
+            parts.append(rows)
+            nread += 1
+    del old
+
+    dtype = [(k, np.int64) for k in keynames] + [("file", np.int32), ("row", np.int64)]
+    events = np.concatenate(parts) if len(parts) > 0 else np.empty(0, dtype=dtype)
+    keys = [events[k] for k in keynames]
+    widths = _key_widths([keys])
+    packed = _pack_with(keys, widths)
+    order = np.argsort(packed, kind="stable")
+
+    version = _fingerprint(files, widths, time.time(), os.getpid())[:16]
+    base = os.path.join(indexdir, "events.%s" % version)
+    # np.save adds .npy to a name, a file object keeps it exact
+    with open(base + ".npy", "wb") as f :
+        np.save(f, events[order])
+    with open(base + ".key.npy", "wb") as f :
+        np.save(f, packed[order])
+    meta = {"node" : nodename, "keys" : keynames, "widths" : widths, "version" : version, 
+            "files" : files}
+    # readers are switched to the new version at once
+    save_manifest(meta, metaname)
+    for name in oldnames :
+        try :
+            os.remove(name)
+        except OSError :
+            # removed by another build
+            pass
+
+    print("event index: %d events in %d files, %d files read" % (len(events), len(files), nread))
+    return EventIndex(indexdir)
+
+#--------------------------------------------------
+def fetch_events(index, events, nodenames=None, pool=None) :
+    """
+    Read full rows of events with the event index.
+    Only files that have the events are opened.
+
+    Parameters
+    ----------
+    index : EventIndex or str
+        index or its directory
+
+    events : array like of shape (n, nkeys)
+        e.g. [(run, event), ...]
+
+    nodenames : list of str
+        nodes to read. rows of these nodes must be aligned
+        with the index node in each file. 
+        if None, the index node is read.
+
+    pool : TablePool
+        pool to open files. if None, files are closed
+        before returning.
+
+    Returns
+    ----------
+    rows : dict
+        {nodename: structured numpy array of rows}, rows
+        are in order of events. keys are same as given in
+        nodenames as read_tables_multi does (by default 
+        index.nodename without the leading "/", e.g. 
+        "I3EventHeader").
+
+    query : numpy array
+        index of events for each row. events without
+        any row are not in query.
+    """
+    if isinstance(index, str) :
+        index = EventIndex(index)
+    if nodenames is None :
+        nodenames = [index.nodename[1:]]
+
+    query, files, rows = index.lookup(events)
+    order = np.lexsort((rows, files))
+    parts = dict([(n, []) for n in nodenames])
+    places = []
+    with _scoped_pool(pool) as pool :
+        for ifile in np.unique(files) :
+            selected = order[files[order] == ifile]
+            myt = _handle(index.files[ifile], pool)
+            for nodename in nodenames :
+                parts[nodename].append(myt.get_node(_nodepath(nodename)).read_coordinates(rows[selected]))
+            places.append(selected)
+
+    # back to the order of events
+    places = np.concatenate(places) if len(places) > 0 else np.zeros(0, dtype=int)
+    back = np.argsort(places, kind="stable")
+    results = {}
+    for nodename in nodenames :
+        if len(parts[nodename]) > 0 :
+            results[nodename] = np.concatenate(parts[nodename])[back]
+        else :
+            results[nodename] = np.zeros(0)
+    return results, query
+
+#--------------------------------------------------
+def export_arrow(tablelist, leaves, outname, **kwargs) :
+    """
+    Export merged leaves as one Arrow IPC (Feather v2) file,
+    which DuckDB, Polars, pandas etc. can read without HDF5.
+    Columns are named "<node>/<leaf>" and written uncompressed
+    in one record batch, so read_arrow can return them as
+    zero-copy views of the memory-mapped file.
+    pyarrow is required.
+
+    Parameters
+    ----------
+    tablelist : str or list of tables or list of str or dict
+        same as read_tables
+
+    leaves : dict
+        {nodename: [leafname, ...]}, all leaves must have
+        same number of rows.
+
+    outname : str
+        output filename, e.g. "merged.arrow". It's written 
+        to outname.tmp and renamed when finished.
+
+    kwargs :
+        passed to read_tables_multi, e.g. workers, dtype, where,
+        cachedir or out_path (columns are staged in .npy 
+        memmaps instead of memory)
+
+    Returns
+    ----------
+    nrows : int
+        number of exported rows
+    """
+    import pyarrow as pa
+
+    bufs = read_tables_multi(tablelist, leaves, **kwargs)
+    names = []
+    arrays = []
+    fields = []
+    for nodename, leafnames in leaves.items() :
+        for leafname in leafnames :
+            buf = bufs[nodename][leafname]
+            name = "%s/%s" % (nodename.strip("/"), leafname)
+            # pa.array of contiguous numpy array doesn't copy
+            arr = pa.array(np.ascontiguousarray(buf).reshape(-1))
+            inner = int(np.prod(buf.shape[1:]))
+            if buf.ndim > 1 :
+                arr = pa.FixedSizeListArray.from_arrays(arr, inner)
+            names.append(name)
+            arrays.append(arr)
+            fields.append(pa.field(name, arr.type, nullable=False,
+                                   metadata={"shape" : json.dumps(list(buf.shape[1:]))}))
+
+    nrows = set([len(a) for a in arrays])
+    if len(nrows) > 1 :
+        raise ValueError("export_arrow: leaves have different number of rows %s" % 
+                         dict(zip(names, [len(a) for a in arrays])))
+    nrows = nrows.pop() if len(nrows) > 0 else 0
+
+    schema = pa.schema(fields)
+    batch = pa.RecordBatch.from_arrays(arrays, schema=schema)
+    with pa.OSFile(outname + ".tmp", "wb") as sink :
+        with pa.ipc.new_file(sink, schema) as writer :
+            writer.write_batch(batch)
+    os.rename(outname + ".tmp", outname)
+    return nrows
+
+#--------------------------------------------------
+def read_arrow(fname, columns=None) :
+    """
+    Read an Arrow IPC (Feather v2) file written by export_arrow.
+    The file is memory-mapped and columns are returned as
+    read-only numpy views of it, so nothing is copied or
+    parsed. Boolean columns are bit-packed in Arrow and 
+    can't be viewed, so they are copied.
+    pyarrow is required.
+
+    Parameters
+    ----------
+    fname : str
+        Arrow IPC file
+
+    columns : list of str
+        "<node>/<leaf>" to read. if None, all columns.
+
+    Returns
+    ----------
+    bufs : dict
+        {nodename: {leafname: numpy array}}, same as read_tables_multi
+    """
+    import pyarrow as pa
+
+    reader = pa.ipc.open_file(pa.memory_map(fname, "r"))
+    table = reader.read_all()
+    if columns is None :
+        columns = table.column_names
+
+    bufs = {}
+    for name in columns :
+        nodename, leafname = name.rsplit("/", 1)
+        field = table.schema.field(name)
+        col = table.column(name)
+        col = col.chunk(0) if col.num_chunks == 1 else pa.concat_arrays(col.chunks)
+        shape = []
+        if field.metadata is not None and b"shape" in field.metadata :
+            shape = json.loads(field.metadata[b"shape"])
+        if pa.types.is_fixed_size_list(field.type) :
+            col = col.values
+        zero_copy = not pa.types.is_boolean(col.type)
+        arr = col.to_numpy(zero_copy_only=zero_copy)
+        bufs.setdefault(nodename, {})[leafname] = arr.reshape((len(table),) + tuple(shape))
+    return bufs
+
+#--------------------------------------------------
+def _attach_shm(name) :
+    """
+    attach an existing shared memory block.
+    Before python 3.13 the block is registered to the resource
+    tracker, which is shared with the parent in multiprocessing
+    workers, so it's unlinked only once by the publisher.
+    """
+    from multiprocessing import shared_memory
+    if sys.version_info >= (3, 13) :
+        return shared_memory.SharedMemory(name=name, track=False)
+    return shared_memory.SharedMemory(name=name)
+
+#--------------------------------------------------
+class SharedColumns() :
+    """
+    Merged columns in multiprocessing.shared_memory blocks.
+    The parent publishes columns once and sends the small 
+    picklable handles to workers, which attach zero-copy 
+    numpy views, so N workers use the memory of one copy.
+    Requires python 3.8 or later.
+
+    Usage:
+        with share_tables(files, {"MCPrimary": ["energy", "zenith"]}) as shared :
+            pool.map(job, [(shared.handles, i) for i in range(n)])
+
+        def job(args) :
+            handles, i = args
+            with SharedColumns.attach(handles) as cols :
+                energy = cols["MCPrimary"]["energy"]
+                ...
+
+    The publisher unlinks the blocks on close, attached
+    columns only detach.
+    """
+    def __init__(self) :
+        self.blocks = {}  # {(nodename, leafname): SharedMemory}
+        self.columns = {} # {nodename: {leafname: numpy array}}
+        self.owner = True
+
+    def publish(self, nodename, leafname, arr) :
+        """
+        copy arr to a new shared memory block and return
+        the numpy view of it
+        """
+        from multiprocessing import shared_memory
+        arr = np.asarray(arr)
+        shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        view = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+        view[...] = arr
+        self.blocks[(nodename, leafname)] = shm
+        self.columns.setdefault(nodename, {})[leafname] = view
+        return view
+
+    @property
+    def handles(self) :
+        """
+        {nodename: {leafname: [block name, dtype, shape]}}
+        """
+        handles = {}
+        for (nodename, leafname), shm in self.blocks.items() :
+            view = self.columns[nodename][leafname]
+            handles.setdefault(nodename, {})[leafname] = [shm.name, view.dtype.str, list(view.shape)]
+        return handles
+
+    @classmethod
+    def attach(cls, handles) :
+        """
+        attach columns published in another process
+        """
+        shared = cls()
+        shared.owner = False
+        for nodename, leafs in handles.items() :
+            for leafname, (name, dtype, shape) in leafs.items() :
+                shm = _attach_shm(name)
+                view = np.ndarray(tuple(shape), dtype=np.dtype(dtype), buffer=shm.buf)
+                view.flags.writeable = False
+                shared.blocks[(nodename, leafname)] = shm
+                shared.columns.setdefault(nodename, {})[leafname] = view
+        return shared
+
+    def close(self) :
+        """
+        detach the blocks, and unlink them if they are
+        published by this object. Views must not be used after.
+        """
+        self.columns = {}
+        for shm in self.blocks.values() :
+            try :
+                shm.close()
+            except BufferError :
+                # views are still referred, the block is freed 
+                # when they are gone
+                pass
+            if self.owner :
+                shm.unlink()
+        self.blocks = {}
+
+    def __getitem__(self, nodename) :
+        return self.columns[nodename]
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, *args) :
+        self.close()
+
+#--------------------------------------------------
+def share_tables(tablelist, leaves, **kwargs) :
+    """
+    Read leaves with read_tables_multi and publish them
+    in shared memory.
+
+    Parameters
+    ----------
+    tablelist : str or list of tables or list of str or dict
+        same as read_tables
+
+    leaves : dict
+        {nodename: [leafname, ...]}
+
+    kwargs :
+        passed to read_tables_multi, e.g. workers, dtype, where
+
+    Returns
+    ----------
+    shared : SharedColumns
+        pass shared.handles to workers and 
+        close shared when they are finished.
+    """
+    bufs = read_tables_multi(tablelist, leaves, **kwargs)
+    shared = SharedColumns()
+    try :
+        for nodename, leafnames in leaves.items() :
+            for leafname in leafnames :
+                shared.publish(nodename, leafname, bufs[nodename].pop(leafname))
+    except Exception :
+        shared.close()
+        raise
+    return shared
+
+#--------------------------------------------------
+class FileWatcher() :
+    """
+    Follow directories where new h5 files keep landing.
+    Each poll discovers files with discover_files, and
+    reads only files that are new since the last poll.
+    Their rows are returned so that running histograms
+    (e.g. HistTools.Hist1D) can be filled incrementally.
+    Files are folded in order of arrival, and the list
+    of folded files only grows, so the column cache (if
+    cachedir is given) is appended in place instead of 
+    rebuilt. Folded files are frozen: they are not stat-ed
+    again and later modifications of them are not read.
+    New files that can't be opened or lack a node are 
+    quarantined (see self.quarantine) and not read again,
+    other files are folded.
+
+    Usage:
+        h = HT.Hist1D(np.linspace(2, 8, 61))
+        watcher = FileWatcher("/data/sim/21002", {"MCPrimary": ["energy"]})
+        def update(bufs, files) :
+            h.fill(np.log10(bufs["MCPrimary"]["energy"]))
+            datum = DT.set_DrawDatum_hist(h, "21002")
+            ...
+        watcher.follow(update, interval=300)
+    """
+    def __init__(self, topdirs, leaves, cachedir=None, manifest=None, settle=60., pool=None, **options) :
+        """
+        Parameters
+        ----------
+        topdirs : str or list of str
+            directories to watch, see discover_files
+
+        leaves : dict
+            {nodename: [leafname, ...]} to read
+
+        cachedir : str
+            if given, columns are kept in the column cache
+            and new rows are appended to it.
+
+        manifest : str
+            if given, the manifest file is updated with new 
+            files and rows are counted from it. it's loaded 
+            once and only new files are scanned in each poll.
+
+        settle : float
+            files modified within settle seconds are regarded 
+            as being written and are left for later polls.
+
+        pool : TablePool
+            pool to open files. if None, files are closed
+            after each poll.
+
+        options :
+            passed to discover_files, e.g. include, exclude, regex
+        """
+        self.topdirs = topdirs
+        self.leaves = leaves
+        self.cachedir = cachedir
+        self.manifest = manifest
+        self.settle = settle
+        self.pool = pool
+        self.options = options
+        self.files = []  # folded files in order of arrival
+        self.stats = []  # [abspath, size, mtime] of folded files when they are read
+        self.known = set() # abspaths of folded and quarantined files
+        self.quarantine = {} # {abspath: error message} of files that can't be read
+        self.entries = None # loaded manifest
+        self.nrows = dict([(n, 0) for n in leaves])
+        self.npolls = 0
+
+    def __repr__(self) :
+        return "FileWatcher(%s, %d files folded, %d quarantined)" % (self.topdirs, len(self.files), 
+                                                                     len(self.quarantine))
+
+    def _new_files(self) :
+        """
+        files not folded yet and not modified recently,
+        and their stats
+        """
+        now = time.time()
+        newfiles = []
+        newstats = []
+        for fname in discover_files(self.topdirs, **self.options) :
+            key = os.path.abspath(fname)
+            if key in self.known :
+                continue
+            st = os.stat(fname)
+            if now - st.st_mtime < self.settle :
+                continue
+            newfiles.append(fname)
+            newstats.append([key, st.st_size, st.st_mtime])
+        return newfiles, newstats
+
+    def _check_files(self, newfiles, newstats, pool) :
+        """
+        open new files and quarantine those that can't be
+        read, returns files and stats of the others
+        """
+        nodenames = [_nodepath(n) for n in self.leaves]
+        goodfiles = []
+        goodstats = []
+        for fname, stat in zip(newfiles, newstats) :
+            try :
+                _count_file_rows(fname, nodenames, pool)
+            except Exception as e :
+                message = _error_message(e)
+                print("FileWatcher: quarantine %s (%s)" % (fname, message))
+                pool.release(fname)
+                self.quarantine[stat[0]] = message
+                self.known.add(stat[0])
+                continue
+            goodfiles.append(fname)
+            goodstats.append(stat)
+        return goodfiles, goodstats
+
+    def _update_manifest(self, newfiles) :
+        """
+        scan only new files, add them to the loaded 
+        manifest and save it. returns the manifest of 
+        new files.
+        """
+        if self.entries is None :
+            self.entries = {"files" : []}
+            if os.path.exists(self.manifest) :
+                self.entries = load_manifest(self.manifest)
+        manifest = build_manifest(newfiles, self.entries, checksum=False)
+        names = set([entry["name"] for entry in manifest["files"]])
+        self.entries["files"] = [entry for entry in self.entries["files"] if not entry["name"] in names] + \
+                                manifest["files"]
+        save_manifest(self.entries, self.manifest)
+        return manifest
+
+    def poll(self) :
+        """
+        Read new files once.
+
+        Returns
+        ----------
+        bufs : dict or None
+            {nodename: {leafname: numpy array}} of rows of
+            the new files, None if there is no new file.
+        """
+        self.npolls += 1
+        newfiles, newstats = self._new_files()
+        if len(newfiles) == 0 :
+            return None
+
+        with _scoped_pool(self.pool) as pool :
+            newfiles, newstats = self._check_files(newfiles, newstats, pool)
+            if len(newfiles) == 0 :
+                return None
+
+            tablelist = newfiles
+            if self.manifest is not None :
+                tablelist = self._update_manifest(newfiles)
+
+            if self.cachedir is not None :
+                # stats of folded files are frozen, so the cache of them 
+                # is always the head and only rows of new files are read
+                paths = dict([(_nodepath(n), list(l)) for n, l in self.leaves.items()])
+                allbufs = _read_cached_columns(self.files + newfiles, paths, self.cachedir, pool=pool, 
+                                               stats=self.stats + newstats)[0]
+                bufs = {}
+                for nodename, leafnames in self.leaves.items() :
+                    path = _nodepath(nodename)
+                    bufs[nodename] = dict([(l, allbufs[path][l][self.nrows[nodename]:]) for l in leafnames])
+            else :
+                bufs = read_tables_multi(tablelist, self.leaves, pool=pool)
+
+        self.stats += newstats
+        self.known.update([s[0] for s in newstats])
+        self.files += newfiles
+        for nodename, leafnames in self.leaves.items() :
+            self.nrows[nodename] += len(bufs[nodename][leafnames[0]])
+        return bufs
+
+    def follow(self, callback, interval=60., max_polls=None) :
+        """
+        Poll every interval seconds and call 
+        callback(bufs, newfiles) when new files are read.
+        Stops after max_polls polls or by Ctrl-C.
+        """
+        try :
+            while max_polls is None or self.npolls < max_polls :
+                nfiles = len(self.files)
+                bufs = self.poll()
+                if bufs is not None :
+                    newfiles = self.files[nfiles:]
+                    print("FileWatcher: %d new files, %d files in total" % (len(newfiles), len(self.files)))
+                    callback(bufs, newfiles)
+                if max_polls is None or self.npolls < max_polls :
+                    time.sleep(interval)
+        except KeyboardInterrupt :
+            print("FileWatcher: stopped, %d files folded" % len(self.files))
+
+#--------------------------------------------------
+if __name__ == "__main__" :
+    import argparse
+    parser = argparse.ArgumentParser(description="merge nodes of many h5 files into one chunked h5 file")
+    parser.add_argument("-i", "--input", required=True,
+                        help="list file of h5 files, or h5 filename with wildcard (quote it)")
+    parser.add_argument("-o", "--output", required=True, help="output h5 filename")
+    parser.add_argument("-n", "--node", action="append", dest="nodes", default=None,
+                        help="node to merge, can be given multiple times (default: all tables)")
+    parser.add_argument("--chunk-rows", type=int, default=READ_CHUNK_ROWS,
+                        help="max number of rows read and written at once")
+    parser.add_argument("--complib", default="blosc", help="blosc, blosc:lz4, blosc:zstd, zlib, ...")
+    parser.add_argument("--complevel", type=int, default=5, help="0-9, 0 for no compression")
+    parser.add_argument("--chunkshape", type=int, default=None, help="rows per HDF5 chunk of output tables")
+    parser.add_argument("--workdir", default=None,
+                        help="run a resumable sharded merge with plan, shard outputs and quarantine lists here")
+    parser.add_argument("--files-per-shard", type=int, default=500, help="number of files in one shard")
+    parser.add_argument("--shard", type=int, action="append", dest="shards", default=None,
+                        help="shard to merge, can be given multiple times (default: all shards)")
+    parser.add_argument("--workers", type=int, default=0, help="number of processes to merge shards")
+    args = parser.parse_args()
+
+    options = dict(chunk_rows=args.chunk_rows, complib=args.complib, 
+                   complevel=args.complevel, chunkshape=args.chunkshape)
+    if args.workdir is None :
+        merge_files(args.input, args.output, args.nodes, **options)
+    else :
+        missing = merge_sharded(args.input, args.workdir, args.output, args.files_per_shard, args.nodes, 
+                                shards=args.shards, workers=args.workers, **options)
+        sys.exit(1 if args.shards is None and len(missing) > 0 else 0)